@@ -0,0 +1,148 @@
+import re
+from statistics import mean
+
+# iperf3 prints Bytes in binary and bits in decimal units
+BYTE_UNITS = {'': 1, 'K': 2**10, 'M': 2**20, 'G': 2**30, 'T': 2**40}
+BIT_UNITS = {'': 1, 'K': 1e3, 'M': 1e6, 'G': 1e9, 'T': 1e12}
+# [  4] local 10.52.22.1 port 12345 connected to 10.152.10.48 port 5201
+CONNECTED_LINE = re.compile(r"^\[\s*\d+\]\s+local\s+\S+\s+port\s+\d+\s+connected to")
+# [  4]   0.00-1.00   sec  11.2 MBytes  94.0 Mbits/sec    0    212 KBytes
+# [  4]   0.00-10.00  sec   112 MBytes  94.1 Mbits/sec    0             sender
+INTERVAL_LINE = re.compile(
+    r"^\[\s*(?P<id>\d+|SUM)\]\s+(?P<start>[\d.]+)-\s*(?P<end>[\d.]+)\s+sec\s+"
+    r"(?P<bytes>[\d.]+)\s+(?P<bytes_unit>[KMGT]?)Bytes\s+"
+    r"(?P<bps>[\d.]+)\s+(?P<bps_unit>[KMGT]?)bits/sec"
+    r"(?:\s+(?P<retransmits>\d+))?.*?(?P<role>sender|receiver)?\s*$")
+
+
+def sum_values(lines):
+    ''' Sum bytes, rates and retransmits of stream lines of the same interval.
+    '''
+    retransmits = [line['retransmits'] for line in lines if line['retransmits'] is not None]
+    return {
+        'start': lines[0]['start'],
+        'end': lines[0]['end'],
+        'bytes': sum(line['bytes'] for line in lines),
+        'bits_per_second': sum(line['bits_per_second'] for line in lines),
+        'retransmits': sum(retransmits) if retransmits else None,
+    }
+
+
+class IperfTextParser:
+
+    def __init__(self):
+        ''' Parse iperf3 text output (without -J) as it streams in.
+        Stream lines of the same interval are summed, [SUM] lines of
+        parallel runs are skipped as they repeat the stream lines.
+        '''
+        self.buffer = ""
+        self.streams = 0
+        self.intervals = []
+        self.current = []
+        self.summary_lines = {'sender': [], 'receiver': []}
+
+    def feed(self, chunk):
+        ''' Add a chunk of output.
+            Output: list of intervals completed by this chunk
+        '''
+        self.buffer += chunk.replace('\r', '')
+        lines = self.buffer.split('\n')
+        self.buffer = lines.pop()
+        completed = []
+        for line in lines:
+            if CONNECTED_LINE.match(line.strip()):
+                self.streams += 1
+                continue
+            match = INTERVAL_LINE.match(line.strip())
+            if match is None or match['id'] == 'SUM':
+                continue
+            values = {
+                'start': float(match['start']),
+                'end': float(match['end']),
+                'bytes': int(float(match['bytes']) * BYTE_UNITS[match['bytes_unit']]),
+                'bits_per_second': float(match['bps']) * BIT_UNITS[match['bps_unit']],
+                'retransmits': int(match['retransmits']) if match['retransmits'] else None,
+            }
+            if match['role']:
+                self.summary_lines[match['role']].append(values)
+                continue
+            if self.current and self.current[0]['end'] != values['end']:
+                completed.append(self.close_interval())
+            self.current.append(values)
+            # every stream reported this interval, no need to wait for the next one
+            if len(self.current) >= max(self.streams, 1):
+                completed.append(self.close_interval())
+        return completed
+
+    def close_interval(self):
+        interval = sum_values(self.current)
+        self.intervals.append(interval)
+        self.current = []
+        return interval
+
+    def finish(self):
+        ''' Flush the last interval once the output is complete.
+            Output: all intervals
+        '''
+        self.feed("\n")
+        if self.current:
+            self.close_interval()
+        return self.intervals
+
+    def summary(self, role):
+        ''' Summary printed by iperf3 at the end of the test, None if it was not printed.
+        '''
+        if not self.summary_lines[role]:
+            return None
+        return sum_values(self.summary_lines[role])
+
+
+class ConvergenceDetector:
+
+    def __init__(self, window, tolerance, min_duration):
+        ''' Throughput is converged once the last `window` intervals stay within
+        `tolerance` (relative spread (max-min)/mean) and at least
+        `min_duration` secs of the test have passed.
+        '''
+        self.window = window
+        self.tolerance = tolerance
+        self.min_duration = min_duration
+        self.spread = None
+
+    def converged(self, intervals):
+        if len(intervals) < self.window:
+            return False
+        rates = [interval['bits_per_second'] for interval in intervals[-self.window:]]
+        average = mean(rates)
+        self.spread = (max(rates) - min(rates)) / average if average > 0 else None
+        return intervals[-1]['end'] >= self.min_duration and \
+            self.spread is not None and self.spread <= self.tolerance
+
+
+def to_iperf3_json(parser, adaptive):
+    ''' Build an iperf3 -J shaped document from parsed text output, so adaptive
+    runs go through the same parsing as regular ones. When the test was stopped
+    before iperf3 printed its summary, the summary is computed from the intervals.
+        Input: adaptive (dictionary with stop reason and convergence statistics)
+    '''
+    intervals = parser.finish()
+    if not intervals:
+        return {'error': "no iperf3 intervals in the output", 'adaptive': adaptive}
+    duration = intervals[-1]['end']
+    computed = {
+        'start': 0,
+        'end': duration,
+        'seconds': duration,
+        'bytes': sum(interval['bytes'] for interval in intervals),
+        'bits_per_second': sum(interval['bits_per_second'] * (interval['end'] - interval['start'])
+                               for interval in intervals) / duration if duration > 0 else 0,
+        'retransmits': sum(interval['retransmits'] or 0 for interval in intervals),
+    }
+    sum_sent = parser.summary('sender') or computed
+    sum_received = parser.summary('receiver') or computed
+    return {
+        'intervals': [{'sum': dict(interval, seconds=interval['end'] - interval['start'])}
+                      for interval in intervals],
+        'end': {'sum_sent': sum_sent, 'sum_received': sum_received},
+        'adaptive': adaptive,
+    }
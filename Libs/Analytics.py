@@ -0,0 +1,61 @@
+def get_interval_series(jsonData):
+    ''' Per-interval series of an iperf3 -J output, stored with the device record.
+        Output: {'end': [secs], 'bps': [bits_per_second], 'retransmits': [count or None]}
+    '''
+    series = {'end': [], 'bps': [], 'retransmits': []}
+    for interval in jsonData.get('intervals', []):
+        series['end'].append(interval['sum']['end'])
+        series['bps'].append(interval['sum']['bits_per_second'])
+        series['retransmits'].append(interval['sum'].get('retransmits'))
+    return series
+
+
+def to_matrix(rows, width):
+    ''' Pad rows of unequal length with NaN into a 2D float array.
+    '''
+    import numpy as np
+    matrix = np.full((len(rows), width), np.nan)
+    for i, row in enumerate(rows):
+        matrix[i, :len(row)] = [np.nan if value is None else value for value in row]
+    return matrix
+
+
+def fleet_interval_statistics(series_by_host, ramp_up_ratio=0.9):
+    ''' Interval statistics of all hosts computed in one batched pass.
+        Input: {hostname: series as returned by get_interval_series()}
+        Output: {hostname: {'p5', 'median', 'p95', 'cv', 'ramp_up_secs', 'retransmits_per_sec'}}
+    '''
+    # numpy is imported once the first results are analysed, not on start
+    import numpy as np
+    hosts = [host for host, series in series_by_host.items() if series and series['bps']]
+    if not hosts:
+        return {}
+    width = max(len(series_by_host[host]['bps']) for host in hosts)
+    bps = to_matrix([series_by_host[host]['bps'] for host in hosts], width)
+    ends = to_matrix([series_by_host[host]['end'] for host in hosts], width)
+    retransmits = to_matrix([series_by_host[host]['retransmits'] for host in hosts], width)
+
+    p5, median, p95 = np.nanpercentile(bps, [5, 50, 95], axis=1)
+    mean = np.nanmean(bps, axis=1)
+    cv = np.divide(np.nanstd(bps, axis=1), mean, out=np.zeros_like(mean), where=mean > 0)
+    # end of the first interval which reached ramp_up_ratio of the median
+    first_reached = (bps >= ramp_up_ratio * median[:, None]).argmax(axis=1)
+    ramp_up = ends[np.arange(len(hosts)), first_reached]
+    duration = np.nanmax(ends, axis=1)
+    has_retransmits = ~np.all(np.isnan(retransmits), axis=1)
+    retransmit_rate = np.where(has_retransmits,
+                               np.nansum(retransmits, axis=1) / np.where(duration > 0, duration, 1),
+                               np.nan)
+
+    statistics = {}
+    for i, host in enumerate(hosts):
+        statistics[host] = {
+            'p5': int(p5[i]),
+            'median': int(median[i]),
+            'p95': int(p95[i]),
+            'cv': round(float(cv[i]), 4),
+            'ramp_up_secs': round(float(ramp_up[i]), 2),
+            'retransmits_per_sec': None if np.isnan(retransmit_rate[i])
+                                   else round(float(retransmit_rate[i]), 2),
+        }
+    return statistics
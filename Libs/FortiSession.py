@@ -0,0 +1,390 @@
+import re
+import threading
+import time
+from collections import OrderedDict
+from Libs.Functions import Logger
+from Libs.Adaptive import IperfTextParser
+from Libs.Adaptive import ConvergenceDetector
+from Libs.Adaptive import to_iperf3_json
+
+
+class JsonStreamScanner:
+
+    def __init__(self):
+        ''' Find the end of the first JSON document in a stream of text chunks.
+        Tracks brace depth outside of JSON strings, so chunks are scanned
+        only once however the output is split.
+        '''
+        self.text = ""
+        self.start = -1
+        self.end = -1
+        self.depth = 0
+        self.in_string = False
+        self.escaped = False
+        self.position = 0
+
+    def feed(self, chunk):
+        ''' Add a chunk, return True once the JSON document is complete.
+        '''
+        self.text += chunk
+        while self.end < 0 and self.position < len(self.text):
+            char = self.text[self.position]
+            if self.start < 0:
+                if char == '{':
+                    self.start = self.position
+                    self.depth = 1
+            elif self.in_string:
+                if self.escaped:
+                    self.escaped = False
+                elif char == '\\':
+                    self.escaped = True
+                elif char == '"':
+                    self.in_string = False
+            elif char == '"':
+                self.in_string = True
+            elif char == '{':
+                self.depth += 1
+            elif char == '}':
+                self.depth -= 1
+                if self.depth == 0:
+                    self.end = self.position + 1
+            self.position += 1
+        return self.end >= 0
+
+    def document(self):
+        ''' Return the JSON document, or everything after its start if incomplete.
+        '''
+        if self.start < 0:
+            return ""
+        return self.text[self.start:self.end if self.end >= 0 else len(self.text)]
+
+
+class FortiSession:
+
+    def __init__(self, inputVars, fortigate_ip):
+        ''' SSH session to a Fortigate driven by its prompt instead of fixed delays.
+        Wall-clock time of every phase is stored in self.timings (secs),
+        self.spans keeps start and duration of every phase and command for tracing.
+        '''
+        self.fortigate_ip = fortigate_ip
+        self.read_timeout = inputVars.fortigate.read_timeout
+        self.device = {
+            'device_type': 'fortinet',
+            'ip': fortigate_ip,
+            'port': inputVars.fortigate.port,
+            'username': inputVars.fortigate.username,
+            'password': inputVars.fortigate.password,
+            'secret': inputVars.fortigate.password,
+            'conn_timeout': inputVars.fortigate.connect_timeout,
+            'verbose': False,
+            'ssh_config_file': '~/.ssh/config'
+        }
+        self.session = None
+        self.prompt_pattern = None
+        self.timings = {}
+        self.spans = []
+        # set by abort(), also ends the wait before a connect retry
+        self.aborted = threading.Event()
+
+    def record(self, name, time_start, time_end=None, **args):
+        time_end = time_end or time.time()
+        self.spans.append({'name': name, 'start': time_start,
+                           'duration': time_end - time_start, 'args': args})
+
+    def timed(self, phase, function, *args, **kwargs):
+        time_start = time.time()
+        try:
+            return function(*args, **kwargs)
+        finally:
+            self.timings[phase] = round(time.time() - time_start, 3)
+            self.record(phase, time_start)
+
+    @staticmethod
+    def preload():
+        ''' Import netmiko ahead of the tests, processes forked afterwards inherit it
+        instead of importing it again for every device.
+        '''
+        import netmiko
+
+    @staticmethod
+    def is_transient(error):
+        ''' Timeouts, refused or reset connections and SSH errors are worth
+        a retry, wrong credentials are not.
+        '''
+        from netmiko import NetmikoAuthenticationException
+        from netmiko import NetmikoTimeoutException
+        from paramiko import SSHException
+        if isinstance(error, NetmikoAuthenticationException):
+            return False
+        return isinstance(error, (NetmikoTimeoutException, SSHException, TimeoutError,
+                                  OSError, EOFError))
+
+    def connect(self):
+        # netmiko (and paramiko) take longer to import than a dry run takes,
+        # they are loaded once a session is opened
+        from netmiko import ConnectHandler
+        self.check_aborted()
+        self.session = self.timed('connect', ConnectHandler, **self.device)
+        # aborted while the connection was opened, close() disconnects it
+        self.check_aborted()
+        self.session.ansi_escape_codes = False
+        self.timed('enable', self.session.enable)
+        # "FGT60F # " or "FGT60F (vdom) # ", echoed commands may follow on the same line
+        self.prompt_pattern = re.compile(re.escape(self.session.base_prompt) +
+                                         r"\s*(\([^)]*\)\s*)?[#$]")
+        return self
+
+    def check_aborted(self):
+        if self.aborted.is_set():
+            raise TimeoutError(f"{ self.fortigate_ip }: session aborted.")
+
+    def read_until(self, done, timeout):
+        ''' Read the channel until done(output, last_chunk) is True or timeout expires.
+        '''
+        output = ""
+        deadline = time.time() + timeout
+        while time.time() < deadline:
+            self.check_aborted()
+            chunk = self.session.read_channel()
+            if chunk:
+                output += chunk
+                if done(output, chunk):
+                    return output
+            else:
+                time.sleep(0.02)
+        raise TimeoutError(f"{ self.fortigate_ip }: no prompt within { timeout } secs.")
+
+    def send_setup(self, commands):
+        ''' Send all setup commands in a single write,
+        then wait for the prompt after each of them.
+        A command span ends when its prompt is read.
+        '''
+        marks = []
+
+        def done(output, chunk):
+            prompts = len(self.prompt_pattern.findall(output))
+            while len(marks) <= min(prompts, len(commands)):
+                marks.append(time.time())
+            return prompts >= len(commands)
+
+        def send():
+            marks.append(time.time())
+            self.session.write_channel(self.session.RETURN.join(commands) + self.session.RETURN)
+            try:
+                return self.read_until(done, self.read_timeout)
+            finally:
+                for command, time_start, time_end in zip(commands, marks, marks[1:]):
+                    self.record('command', time_start, time_end, command=command)
+
+        return self.timed('setup', send)
+
+    def run_test(self, command, phase='test'):
+        ''' Run the traffictest and stream its -J output until the JSON
+        document is closed or the prompt returns (e.g. on iperf3 errors).
+        The prompt after the document is read as well, otherwise the next
+        command (e.g. the -R pass) would take it for its own.
+            Output: JSON document (string), empty if none was printed
+        '''
+        scanner = JsonStreamScanner()
+
+        def done(output, chunk):
+            return scanner.feed(chunk) or \
+                (scanner.start < 0 and self.prompt_pattern.search(output) is not None)
+
+        def drained(output, chunk):
+            return self.prompt_pattern.search(output) is not None
+
+        def send():
+            self.session.write_channel(command + self.session.RETURN)
+            self.read_until(done, self.read_timeout)
+            if scanner.end >= 0 and self.prompt_pattern.search(scanner.text, scanner.end) is None:
+                try:
+                    self.read_until(drained, self.read_timeout)
+                except TimeoutError:
+                    pass
+            return scanner.document()
+
+        return self.timed(phase, send)
+
+    def run_adaptive_test(self, command, adaptive, phase='test'):
+        ''' Run the traffictest without -J and watch its interval lines.
+        The test is interrupted (Ctrl+C) as soon as throughput converges,
+        otherwise it runs until the -t cap of the command. A test without
+        a prompt after that cap is flagged 'partial', an aborted test raises.
+            Input: adaptive (inputVars.adaptive settings)
+            Output: iperf3 -J shaped document (dictionary) with an 'adaptive' section
+        '''
+        parser = IperfTextParser()
+        detector = ConvergenceDetector(adaptive.window, adaptive.tolerance, adaptive.min_duration)
+        state = {'reason': "completed"}
+
+        def done(output, chunk):
+            if parser.feed(chunk) and detector.converged(parser.intervals):
+                state['reason'] = "converged"
+                return True
+            return self.prompt_pattern.search(output) is not None
+
+        def drained(output, chunk):
+            parser.feed(chunk)
+            return self.prompt_pattern.search(output) is not None
+
+        def send():
+            self.session.write_channel(command + self.session.RETURN)
+            try:
+                self.read_until(done, adaptive.max_duration + self.read_timeout)
+            except TimeoutError:
+                # an abort of the scheduler is a failed test, not a result
+                if self.aborted.is_set():
+                    raise
+                state['reason'] = "timeout"
+            if state['reason'] != "completed":
+                # stop the test, collect whatever iperf3 prints until the prompt returns
+                self.session.write_channel("\x03")
+                try:
+                    self.read_until(drained, self.read_timeout)
+                except TimeoutError:
+                    if self.aborted.is_set():
+                        raise
+            return to_iperf3_json(parser, {
+                'stop_reason': state['reason'],
+                'partial': state['reason'] == "timeout",
+                'duration': parser.intervals[-1]['end'] if parser.intervals else 0,
+                'window': adaptive.window,
+                'tolerance': adaptive.tolerance,
+                'spread': None if detector.spread is None else round(detector.spread, 4),
+            })
+
+        return self.timed(phase, send)
+
+    def is_alive(self):
+        ''' True if the SSH transport is up, checked without writing to the channel.
+        '''
+        try:
+            return self.session is not None and self.session.remote_conn.get_transport().is_active()
+        except AttributeError:
+            return False
+
+    def reset(self):
+        ''' Prepare a kept session for the next test: clear timings and spans,
+        drop leftover output and wait for a fresh prompt.
+        '''
+        self.timings = {}
+        self.spans = []
+
+        def send():
+            self.session.clear_buffer(backoff=False)
+            self.session.write_channel(self.session.RETURN)
+            return self.read_until(lambda output, chunk: self.prompt_pattern.search(output) is not None,
+                                   self.read_timeout)
+
+        return self.timed('reset', send)
+
+    def abort(self):
+        ''' Make a connect or read running in another thread fail, e.g. of a test on timeout.
+        A connect already in progress fails once it returns.
+        '''
+        self.aborted.set()
+
+    def disconnect(self):
+        if self.session is not None:
+            self.timed('disconnect', self.session.disconnect)
+            self.session = None
+
+    def close(self):
+        ''' Disconnect, also from a broken session.
+        '''
+        try:
+            self.disconnect()
+        except Exception:
+            self.session = None
+
+
+class FortiSessionPool:
+
+    def __init__(self, inputVars, max_size=32, idle_timeout=240):
+        ''' Bounded LRU pool of authenticated Fortigate sessions kept between tests.
+        A session is taken out of the pool for a test and put back after it,
+        idle sessions are closed least recently used first when the pool is full
+        and once they were idle for idle_timeout secs.
+        '''
+        self.inputVars = inputVars
+        self.max_size = max_size
+        self.idle_timeout = idle_timeout
+        self.idle = OrderedDict()
+        self.in_use = {}
+        self.lock = threading.Lock()
+        self.hits = 0
+        self.misses = 0
+
+    def acquire(self, fortigate_ip):
+        ''' Return the warm session of the device, or a new not yet connected one.
+        '''
+        logger = Logger().get_logger()
+        with self.lock:
+            session, last_used = self.idle.pop(fortigate_ip, (None, None))
+        if session is not None:
+            try:
+                if not session.is_alive():
+                    raise EOFError("transport is closed")
+                session.reset()
+                self.hits += 1
+            except Exception as e:
+                logger.debug(f"  ... Kept session to { fortigate_ip } is not usable: { e }")
+                session.close()
+                session = None
+        if session is None:
+            self.misses += 1
+            session = FortiSession(self.inputVars, fortigate_ip)
+        with self.lock:
+            self.in_use[fortigate_ip] = session
+        return session
+
+    def release(self, fortigate_ip, session):
+        ''' Keep a session after a successful test, evict the least recently used.
+        '''
+        with self.lock:
+            self.in_use.pop(fortigate_ip, None)
+            self.idle[fortigate_ip] = (session, time.time())
+            evicted = []
+            while len(self.idle) > self.max_size:
+                evicted.append(self.idle.popitem(last=False)[1][0])
+        for session in evicted:
+            session.close()
+
+    def discard(self, fortigate_ip, session):
+        ''' Close a session which failed during a test.
+        '''
+        with self.lock:
+            self.in_use.pop(fortigate_ip, None)
+        session.close()
+
+    def abort(self, fortigate_ip):
+        with self.lock:
+            session = self.in_use.get(fortigate_ip)
+        if session is not None:
+            session.abort()
+
+    def evict_idle(self):
+        ''' Close sessions idle for longer than idle_timeout.
+        '''
+        now = time.time()
+        with self.lock:
+            expired = [ip for ip, (session, last_used) in self.idle.items()
+                       if now - last_used > self.idle_timeout]
+            sessions = [self.idle.pop(ip)[0] for ip in expired]
+        for session in sessions:
+            session.close()
+
+    def close_all(self):
+        with self.lock:
+            sessions = [session for session, last_used in self.idle.values()]
+            sessions += list(self.in_use.values())
+            self.idle.clear()
+            self.in_use.clear()
+        for session in sessions:
+            session.abort()
+            session.close()
+
+    def stats(self):
+        return {'idle': len(self.idle), 'in_use': len(self.in_use),
+                'hits': self.hits, 'misses': self.misses}
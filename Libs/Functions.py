@@ -1,58 +1,108 @@
 import os
-import datetime
 import sys
-from time import sleep
+import json
+import time
+import asyncio
+import atexit
+import contextvars
+import multiprocessing
+from contextlib import contextmanager
 import logging
+from logging.handlers import QueueHandler, QueueListener, RotatingFileHandler
 from pyaml_env import parse_config, BaseConfig
-from netbox import NetBox, status
+import requests
+from requests.adapters import HTTPAdapter
+from Libs.Retry import CircuitBreaker
+from Libs.Retry import CircuitOpenError
+from Libs.Retry import RetryPolicy
 import urllib3
 urllib3.disable_warnings(urllib3.exceptions.InsecureRequestWarning)
 # import pprint
 
 
+# fields bound with Logger.bind() / Logger.context(), per process and per thread
+log_context = contextvars.ContextVar('log_context', default={})
+
+
+class ContextFilter(logging.Filter):
+
+    def filter(self, record):
+        """ Add the bound context fields to the record, as attributes
+        and as the `context` string of the file log format.
+        """
+        fields = log_context.get()
+        for key, value in fields.items():
+            setattr(record, key, value)
+        record.context = "".join(f" { key }={ value }" for key, value in fields.items())
+        return True
+
+
 class Logger:
 
+    # shared by the parent process and its forked children
+    queue = None
+    listener = None
+
     def __init__(self, name=__name__, 
-                 file_level=logging.DEBUG, console_level=logging.ERROR):
+                 file_level=logging.DEBUG, console_level=logging.ERROR,
+                 max_bytes=10 * 1024 * 1024, backup_count=5):
         """
         Initialize the logger.
 
         :param name: Logger name (usually __name__ of the module)
-        :param log_file: Path to the log file
         :param file_level: Logging level for the file handler
         :param console_level: Logging level for the console handler
+        :param max_bytes: Size at which the log file is rotated
+        :param backup_count: Number of rotated log files kept (app.log.1 ...)
         :logger.error => print to stdout and file
         :logger.debug => print only to file
+        Records only go to a queue, a listener thread of the parent process
+        writes them, so test processes and threads never wait on the disk.
         """
         self.file_level = file_level
         self.console_level = console_level
+        self.max_bytes = max_bytes
+        self.backup_count = backup_count
         self.log_file='app.log'
         self.logger = logging.getLogger(name)
         self.logger.setLevel(logging.DEBUG)  # Capture all levels; handlers filter further
 
+    def start_listener(self):
+        """ Own the log file in this process. Child processes forked later
+        inherit the queue handler and log through this listener too.
+        """
+        # File handler - logger.debug(), rotated by size
+        file_handler = RotatingFileHandler(self.log_file, maxBytes=self.max_bytes,
+                                           backupCount=self.backup_count)
+        file_handler.setLevel(self.file_level)
+        file_formatter = logging.Formatter(
+            "[%(asctime)s::%(filename)s::%(lineno)d::%(funcName)s()] %(levelname)s:%(context)s %(message)s", 
+                datefmt='%Y-%m-%dT%H:%M:%S', defaults={'context': ""}
+        )
+        file_handler.setFormatter(file_formatter)
+
+        # Console handler - logger.error()
+        console_handler = logging.StreamHandler(sys.stdout)
+        console_handler.setLevel(self.console_level)
+        console_formatter = logging.Formatter(
+            '%(levelname)s - %(message)s'
+        )
+        console_handler.setFormatter(console_formatter)
+
+        Logger.queue = multiprocessing.Queue()
+        Logger.listener = QueueListener(Logger.queue, file_handler, console_handler,
+                                        respect_handler_level=True)
+        Logger.listener.start()
+        atexit.register(Logger.stop)
+
     def handlers(self):
         # Prevent adding multiple handlers if logger already configured
-        if not self.logger.hasHandlers():
-            # File handler - logger.debug()
-            file_handler = logging.FileHandler(self.log_file)
-            file_handler.setLevel(self.file_level)
-            file_formatter = logging.Formatter(
-                "[%(asctime)s::%(filename)s::%(lineno)d::%(funcName)s()] %(levelname)s: %(message)s", 
-                    datefmt='%Y-%m-%dT%H:%M:%S'
-            )
-            file_handler.setFormatter(file_formatter)
-
-            # Console handler - logger.error()
-            console_handler = logging.StreamHandler(sys.stdout)
-            console_handler.setLevel(self.console_level)
-            console_formatter = logging.Formatter(
-                '%(levelname)s - %(message)s'
-            )
-            console_handler.setFormatter(console_formatter)
-
-            # Add handlers to logger
-            self.logger.addHandler(file_handler)
-            self.logger.addHandler(console_handler)
+        if not self.logger.handlers:
+            if Logger.queue is None:
+                self.start_listener()
+            queue_handler = QueueHandler(Logger.queue)
+            queue_handler.addFilter(ContextFilter())
+            self.logger.addHandler(queue_handler)
 
     def get_logger(self):
         """ Return the configured logger instance.
@@ -60,31 +110,38 @@ class Logger:
         self.handlers()
         return self.logger
 
-    def rotate_old_logs(self, logfile):
-        """ Rename log file if already exists and continues in a fresh file.
+    @staticmethod
+    def stop():
+        """ Write out queued records and stop the listener.
         """
-        if os.path.exists(logfile):
-            ct = os.path.getctime(logfile)
-            dt = datetime.datetime.fromtimestamp(ct).strftime('%Y%m%dT%H%M%S')
-            os.rename(logfile, f"{logfile}.{dt}")
-        return 0
-
-class Utils:
-
-    def __init__(self):
-        pass
+        if Logger.listener is not None:
+            Logger.listener.stop()
+            Logger.listener = None
+
+    @staticmethod
+    def bind(**fields):
+        """ Add context fields (e.g. device=IP) to all further records
+        of this process or thread.
+        """
+        log_context.set(dict(log_context.get(), **fields))
 
-    def check_ip_online(self, ip):
-        logger = Logger().get_logger()
-        logger.debug(f"NOTE: Pinging { ip }")
-        response = os.system(f"ping -c 1 -q { ip }")
-        return response == 0
+    @staticmethod
+    @contextmanager
+    def context(**fields):
+        """ Add context fields to the records logged inside the with block.
+        """
+        token = log_context.set(dict(log_context.get(), **fields))
+        try:
+            yield
+        finally:
+            log_context.reset(token)
 
 
 class Paths:
 
     def __init__(self, inputVars):
-        self.purge_files_in_directory(inputVars.paths.output_files)
+        # Raw outputs of previous runs are kept, stale files of a device
+        # are removed right before the device is tested again.
         self.create_dir_if_not_exist(inputVars.paths.output_files)
         self.create_dir_if_not_exist(inputVars.paths.output_run)
         self.path_run = os.getcwd()+"/"+inputVars.paths.output_run
@@ -98,19 +155,51 @@ class Paths:
         if not os.path.exists(directory):
             os.makedirs(directory)
 
-    def purge_files_in_directory(self, dir):
-        logger = Logger().get_logger()
-        for file in os.listdir(dir):
-            file_path = os.path.join(dir, file)
-            try:
-                os.remove(file_path)
-            except Exception as e:
-                logger.error(f"Failed to delete { file_path }. Reason: { e }")
+
+# Settings added after the first release, an older Vars/input.yaml without them keeps working
+INPUT_DEFAULTS = {
+    'scheduler': {'concurrency': 4, 'timeout': 240, 'uplink_mbps': 0, 'unknown_speed_mbps': 1000},
+    'inventory': {'cache_file': "out_rundata/inventory.json", 'ttl': 3600, 'regions': [1]},
+    'netbox': {'pool_size': 8, 'page_size': 1000, 'timeout': 30},
+    'iperf3_server': {'ready_timeout': 10},
+    'fortigate': {'read_timeout': 60, 'port': 22, 'connect_timeout': 10},
+    'paths': {'history_db': "out_rundata/history.sqlite"},
+    'adaptive': {'enabled': False, 'window': 3, 'tolerance': 0.05, 'min_duration': 5,
+                 'max_duration': 30},
+    'iperf3_client': {'parallel': 1, 'reverse': False, 'bandwidth': "100M", 'profiles': []},
+    'preflight': {'enabled': True, 'port': 22, 'timeout': 2, 'concurrency': 200, 'icmp': False},
+    'tracing': {'trace_file': "out_rundata/trace.json",
+                'prometheus_file': "out_rundata/fortigate_iperf3.prom"},
+    'incremental': {'stale_after': 604800, 'sub_contract_ratio': 0.8, 'include_healthy': True,
+                    'time_budget': 14400},
+    'service': {'listen': "127.0.0.1:8201", 'interval': 86400, 'incremental': True,
+                'output_file': "out_rundata/service_output.json", 'pool_size': 64,
+                'pool_idle_timeout': 240},
+    'sharding': {'node': "", 'strategy': "hash", 'nodes': [], 'vnodes': 64},
+    'retry': {'base_delay': 1, 'max_delay': 30, 'breaker_threshold': 5, 'breaker_reset': 60,
+              'connect_attempts': 3, 'deferred_rounds': 1},
+}
+
+
+def with_defaults(config, defaults):
+    ''' Add the settings of defaults missing in config, sections are merged key by key.
+        Input: parsed config dict, defaults dict
+        Output: config dict
+    '''
+    for key, value in defaults.items():
+        if isinstance(value, dict) and isinstance(config.get(key), dict):
+            with_defaults(config[key], value)
+        elif key not in config or config[key] is None:
+            config[key] = value.copy() if isinstance(value, (dict, list)) else value
+    return config
 
 
 class Vars:
     def __init__(self):
-        self.inputVars = BaseConfig(parse_config('Vars/input.yaml'))
+        config = with_defaults(parse_config('Vars/input.yaml'), INPUT_DEFAULTS)
+        # without a pool the single iperf3_server.port of older configs is used
+        config['iperf3_server'].setdefault('port_pool', [config['iperf3_server']['port']])
+        self.inputVars = BaseConfig(config)
 
 
 class Convert:
@@ -131,24 +220,103 @@ class Convert:
 
 class NetboxAPI:
 
+    # one circuit breaker per Netbox URL, shared by all clients of the process
+    breakers = {}
+
     def __init__(self, inputVars):
-        ''' Open an initial session to Netbox.
+        ''' Netbox REST API client.
+        All requests share one keep-alive, connection-pooled HTTP session
+        which is opened lazily on the first request.
+        Transient errors are retried with backoff, failed attempts are counted in self.retries.
         '''
-        logger = Logger().get_logger()
-        logger.debug(f"::Pulling data from Netbox API [{ inputVars.netbox.ipv4 }]")
         self.inputVars = inputVars
-        counter = self.inputVars.repeat_counter
-        while counter >= 0:
-            try:
-                self.netbox = NetBox(host=inputVars.netbox.ipv4, port=inputVars.netbox.port,
-                                    use_ssl=inputVars.netbox.use_ssl, auth_token=inputVars.netbox.token_ro)
-            except:
-                logger.error(f"  ... attempting to connect... { self.inputVars.repeat_counter - counter +1 }/"
-                      f"{ self.inputVars.repeat_counter + 1}")
-            sleep(1)
-            counter -= 1
+        scheme = "https" if inputVars.netbox.use_ssl else "http"
+        self.url = f"{ scheme }://{ inputVars.netbox.ipv4 }:{ inputVars.netbox.port }/api/"
+        self.session = None
+        if self.url not in NetboxAPI.breakers:
+            NetboxAPI.breakers[self.url] = CircuitBreaker(inputVars.retry.breaker_threshold,
+                                                          inputVars.retry.breaker_reset)
+        self.retry = RetryPolicy(inputVars.repeat_counter + 1, inputVars.retry.base_delay,
+                                 inputVars.retry.max_delay, transient=NetboxAPI.is_transient,
+                                 breaker=NetboxAPI.breakers[self.url], on_retry=self.log_retry)
         return None
 
+    @property
+    def retries(self):
+        return self.retry.retries
+
+    @staticmethod
+    def is_transient(error):
+        ''' Connection errors, timeouts, broken responses and HTTP 5xx, 408 and 429
+        are worth a retry, other HTTP errors (e.g. 403 on a wrong token) are not.
+        '''
+        if isinstance(error, requests.HTTPError) and error.response is not None:
+            return error.response.status_code >= 500 or error.response.status_code in (408, 429)
+        return isinstance(error, (requests.RequestException, ValueError, KeyError))
+
+    def log_retry(self, attempt, error, delay):
+        logger = Logger().get_logger()
+        logger.error(f"    ... attempting to connect... { attempt }/{ self.retry.attempts } ({ error }), "
+                     f"next attempt in { round(delay, 1) } secs")
+
+    def connect(self):
+        ''' Return the shared HTTP session, open it on first use.
+        '''
+        if self.session is None:
+            logger = Logger().get_logger()
+            logger.debug(f"::Pulling data from Netbox API [{ self.inputVars.netbox.ipv4 }]")
+            adapter = HTTPAdapter(pool_connections=1,
+                                  pool_maxsize=self.inputVars.netbox.pool_size)
+            session = requests.Session()
+            session.mount("http://", adapter)
+            session.mount("https://", adapter)
+            session.headers.update({
+                'Authorization': f"Token { self.inputVars.netbox.token_ro }",
+                'Accept': "application/json",
+            })
+            session.verify = False
+            self.session = session
+        return self.session
+
+    def close(self):
+        if self.session is not None:
+            self.session.close()
+            self.session = None
+
+    def get_page(self, endpoint, **params):
+        ''' Single GET of an API endpoint, e.g. 'dcim/devices/'.
+            Output: decoded json (dictionary)
+        '''
+        response = self.connect().get(self.url+endpoint, params=params,
+                                      timeout=self.inputVars.netbox.timeout)
+        response.raise_for_status()
+        return response.json()
+
+    def get_all_pages(self, endpoint, **params):
+        ''' Follow pagination of an API endpoint.
+            Output: results of all pages (list)
+        '''
+        params.setdefault('limit', self.inputVars.netbox.page_size)
+        data = self.get_page(endpoint, **params)
+        results = data['results']
+        while data.get('next'):
+            response = self.connect().get(data['next'], timeout=self.inputVars.netbox.timeout)
+            response.raise_for_status()
+            data = response.json()
+            results.extend(data['results'])
+        return results
+
+    def get(self, endpoint, **params):
+        ''' Get all objects of an API endpoint, retry on transient errors.
+        Stops on the first successful attempt.
+            Output: objects (list) or None if Netbox is not reachable
+        '''
+        logger = Logger().get_logger()
+        try:
+            return self.retry.call(self.get_all_pages, endpoint, **params)
+        except (requests.RequestException, ValueError, KeyError, CircuitOpenError) as e:
+            logger.error(f"      ... Cannot connect to Netbox! ({ e })")
+
     def get_devices_dict(self, hostname=None):
         ''' Get the device dictionary based on hostname input.
             Input: hostname (string)
@@ -156,42 +324,17 @@ class NetboxAPI:
         '''
         logger = Logger().get_logger()
         logger.debug(f"  ... Getting devices data for { hostname }.")
-        counter = self.inputVars.repeat_counter
-        while counter >= 0:
-            try:
-                return self.netbox.dcim.get_devices(name=hostname)
-            except:
-                logger.error(f"    ... attempting to connect... { self.inputVars.repeat_counter - counter +1 }/"
-                      f"{ self.inputVars.repeat_counter + 1}")
-            sleep(1)
-            counter -= 1
-        logger.error(f"      ... Cannot connect to Netbox!")
+        return self.get("dcim/devices/", name=hostname)
 
     def get_devices_dict_by_params(self, **kwargs):
         ''' Get the device dictionary based on provided parameters as input.
+        List values are sent as repeated query parameters.
             Input: variuos parameters (dictionary)
             Output: device (dictionary)
         '''
         logger = Logger().get_logger()
         logger.debug(f"  ... Getting devices data on these parameters {kwargs}")
-        final_list = []
-        for kwarg in kwargs:
-            if type(kwargs[kwarg]) == list:
-                for i in kwargs[kwarg]:
-                    final_list.append(f"{kwarg}={i}")
-            else:
-                final_list.append(f"{kwarg}={kwargs[kwarg]}")
-        # print(final_list)
-        counter = self.inputVars.repeat_counter
-        while counter >= 0:
-            try:
-                return self.netbox.dcim.get_devices(**kwargs)
-            except:
-                logger.error(f"    ... attempting to connect... { self.inputVars.repeat_counter - counter +1 }/"
-                      f"{ self.inputVars.repeat_counter + 1}")
-            sleep(1)
-            counter -= 1
-        logger.error(f"      ... Cannot connect to Netbox!")
+        return self.get("dcim/devices/", **kwargs)
 
     def get_circuits_dict(self):
         ''' Netbox/menu/circuits
@@ -199,16 +342,15 @@ class NetboxAPI:
         '''
         logger = Logger().get_logger()
         logger.debug(f"  ... Getting circuits data.")
-        counter = self.inputVars.repeat_counter
-        while counter >= 0:
-            try:
-                return self.netbox.circuits.get_circuits()
-            except:
-                logger.error(f"    ... attempting to connect... { self.inputVars.repeat_counter - counter +1 }/"
-                      f"{ self.inputVars.repeat_counter + 1}")
-            sleep(1)
-            counter -= 1
-        logger.error(f"      ... Cannot connect to Netbox!")
+        return self.get("circuits/circuits/")
+
+    def get_sites_dict(self, **kwargs):
+        ''' Netbox/menu/sites
+        Retrieve sites data as json, optionally filtered by parameters.
+        '''
+        logger = Logger().get_logger()
+        logger.debug(f"  ... Getting sites data on these parameters {kwargs}")
+        return self.get("dcim/sites/", **kwargs)
 
     def get_site_id_from_device_name(self, device_name, devices):
         ''' Provide api/dcim/devices device name on input.
@@ -235,17 +377,193 @@ class NetboxAPI:
         '''
         logger = Logger().get_logger()
         logger.debug(f"  ... Getting site data for Site ID { site_id }.")
-        counter = self.inputVars.repeat_counter
-        while counter > 0:
-            try:
-                return self.netbox.dcim.get_sites(id=site_id)[0]['custom_fields']['cf_speed']
-            except TypeError:
-                logger.error(f"    ... does the integer value exist at the position of cf_speed field?")
-                counter = 0
-                return 0
-            except:
-                logger.error(f"    ... attempting to connect... { self.inputVars.repeat_counter - counter +1 }/"
-                      f"{ self.inputVars.repeat_counter + 1}")
-            sleep(1)
-            counter -= 1
-        logger.error(f"      ... Cannot connect to Netbox!")
\ No newline at end of file
+        sites = self.get("dcim/sites/", id=site_id)
+        if sites is None:
+            return None
+        try:
+            return sites[0]['custom_fields']['cf_speed']
+        except (IndexError, KeyError, TypeError):
+            logger.error(f"    ... does the integer value exist at the position of cf_speed field?")
+            return 0
+
+
+class AsyncNetboxAPI:
+
+    def __init__(self, netbox_obj):
+        ''' asyncio front-end of NetboxAPI.
+        Up to inputVars.netbox.pool_size requests are in flight at once,
+        each of them runs on the pooled session of netbox_obj in a worker thread.
+        '''
+        self.netbox = netbox_obj
+        self.concurrency = netbox_obj.inputVars.netbox.pool_size
+        self.semaphore = None
+
+    async def get_page(self, endpoint, **params):
+        if self.semaphore is None:
+            self.semaphore = asyncio.Semaphore(self.concurrency)
+        async with self.semaphore:
+            return await asyncio.to_thread(self.netbox.get_page, endpoint, **params)
+
+    async def get_all_pages(self, endpoint, **params):
+        ''' Fetch the first page, then all remaining pages concurrently.
+            Output: results of all pages (list)
+        '''
+        limit = params.pop('limit', self.netbox.inputVars.netbox.page_size)
+        first = await self.get_page(endpoint, limit=limit, offset=0, **params)
+        pages = await asyncio.gather(*[
+            self.get_page(endpoint, limit=limit, offset=offset, **params)
+            for offset in range(limit, first['count'], limit)
+        ])
+        results = first['results']
+        for page in pages:
+            results.extend(page['results'])
+        return results
+
+    async def get(self, endpoint, **params):
+        ''' Same as NetboxAPI.get(), retry on transient errors
+        under the retry policy and circuit breaker of netbox_obj.
+        '''
+        logger = Logger().get_logger()
+        try:
+            return await self.netbox.retry.call_async(self.get_all_pages, endpoint, **params)
+        except (requests.RequestException, ValueError, KeyError, CircuitOpenError) as e:
+            logger.error(f"      ... Cannot connect to Netbox! ({ e })")
+
+    async def gather(self, *queries):
+        ''' Run several (endpoint, params) queries concurrently.
+            Output: list of results in the order of queries
+        '''
+        return await asyncio.gather(*[self.get(endpoint, **params) for endpoint, params in queries])
+
+
+class NetboxInventory:
+
+    def __init__(self, inputVars, filters):
+        ''' In-memory inventory of devices and sites pulled from Netbox.
+        Devices matching filters and all sites are fetched in one bulk pass,
+        indexed by primary IP, hostname and site ID and cached on disk
+        for inputVars.inventory.ttl seconds.
+        '''
+        self.inputVars = inputVars
+        self.filters = filters
+        self.cache_file = inputVars.inventory.cache_file
+        self.ttl = inputVars.inventory.ttl
+        self.devices = []
+        self.sites = []
+        self.by_ip = {}
+        self.by_name = {}
+        self.by_site_id = {}
+        self.retries = 0
+        self.timestamp = 0
+
+    def load(self, refresh=False, stale_ok=False):
+        ''' Load inventory from the cache file if it is fresh (or with stale_ok at any age),
+        otherwise fetch it from Netbox and rewrite the cache.
+        If Netbox cannot be reached, a stale cache is better than no inventory.
+        '''
+        logger = Logger().get_logger()
+        if not refresh and self.load_cache(stale_ok):
+            return self
+        if self.fetch(NetboxAPI(self.inputVars)):
+            self.save_cache()
+        elif self.load_cache(stale_ok=True):
+            logger.error(f"Netbox is not reachable, using the stale inventory cache "
+                         f"of { round(self.age()) } secs.")
+        return self
+
+    def fetch(self, netbox_obj):
+        ''' Bulk fetch devices and sites from Netbox,
+        both endpoints and all their pages concurrently.
+        Returns False if Netbox could not be reached.
+        '''
+        logger = Logger().get_logger()
+        devices, sites = asyncio.run(AsyncNetboxAPI(netbox_obj).gather(
+            ("dcim/devices/", self.filters),
+            ("dcim/sites/", {}),
+        ))
+        netbox_obj.close()
+        self.retries += netbox_obj.retries
+        self.timestamp = time.time()
+        self.devices = devices or []
+        self.sites = sites or []
+        logger.debug(f"  ... Inventory fetched from Netbox: { len(self.devices) } devices, "
+                     f"{ len(self.sites) } sites.")
+        self.build_indexes()
+        return devices is not None and sites is not None
+
+    def build_indexes(self):
+        self.by_ip = {}
+        self.by_name = {}
+        self.by_site_id = {}
+        for device in self.devices:
+            if device.get('primary_ip4'):
+                address = device['primary_ip4']['address']
+                self.by_ip[address] = device
+                self.by_ip[address.split('/')[0]] = device
+            self.by_name[device['name']] = device
+        for site in self.sites:
+            self.by_site_id[site['id']] = site
+
+    def load_cache(self, stale_ok=False):
+        ''' Return True if a fresh cache built with the same filters was loaded.
+        '''
+        logger = Logger().get_logger()
+        if not os.path.exists(self.cache_file):
+            return False
+        try:
+            with open(self.cache_file, 'r') as file:
+                cache = json.load(file)
+        except (OSError, ValueError) as e:
+            logger.debug(f"  ... Inventory cache { self.cache_file } is not readable: { e }")
+            return False
+        age = time.time() - cache.get('timestamp', 0)
+        if (age > self.ttl and not stale_ok) or cache.get('filters') != self.filters:
+            logger.debug(f"  ... Inventory cache { self.cache_file } is stale.")
+            return False
+        self.devices = cache['devices']
+        self.sites = cache['sites']
+        self.timestamp = cache['timestamp']
+        self.build_indexes()
+        logger.debug(f"  ... Inventory loaded from cache { self.cache_file } ({ round(age) } secs old).")
+        return True
+
+    def save_cache(self):
+        directory = os.path.dirname(self.cache_file)
+        if directory and not os.path.exists(directory):
+            os.makedirs(directory)
+        tmp_file = self.cache_file+".tmp"
+        with open(tmp_file, 'w') as file:
+            json.dump({'timestamp': self.timestamp, 'filters': self.filters,
+                       'devices': self.devices, 'sites': self.sites}, file)
+        os.replace(tmp_file, self.cache_file)
+
+    def age(self):
+        ''' Seconds since the inventory was fetched from Netbox.
+        '''
+        return time.time() - self.timestamp
+
+    def get_device_by_ip(self, ip):
+        ''' Accepts IP with or without prefix length.
+        '''
+        return self.by_ip.get(ip) or self.by_ip.get(ip.split('/')[0])
+
+    def get_device_by_name(self, hostname):
+        return self.by_name.get(hostname)
+
+    def get_site(self, site_id):
+        return self.by_site_id.get(site_id)
+
+    def get_circuit_speed(self, site_id):
+        ''' Return ckt speed which is defined as custom field 'cf_speed'
+        in menu/Sites, 0 if the site or the field is missing.
+        '''
+        logger = Logger().get_logger()
+        site = self.get_site(site_id)
+        if site is None:
+            logger.error(f"    ... site ID { site_id } not found in the inventory.")
+            return 0
+        speed = site['custom_fields'].get('cf_speed')
+        if speed is None:
+            logger.error(f"    ... does the integer value exist at the position of cf_speed field?")
+            return 0
+        return speed
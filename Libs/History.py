@@ -0,0 +1,178 @@
+import os
+import sqlite3
+import time
+from statistics import median
+
+
+def percentile(values, percent):
+    ''' Percentile of values with linear interpolation, None if values are empty.
+    '''
+    values = sorted(values)
+    if not values:
+        return None
+    position = (len(values) - 1) * percent / 100
+    lower = int(position)
+    upper = min(lower + 1, len(values) - 1)
+    return values[lower] + (values[upper] - values[lower]) * (position - lower)
+
+
+def to_int(value):
+    try:
+        return int(value)
+    except (TypeError, ValueError):
+        return None
+
+
+class HistoryStore:
+
+    FIELDS = ('upload', 'download')
+    SCHEMA = [
+        '''CREATE TABLE IF NOT EXISTS tests (
+            id INTEGER PRIMARY KEY,
+            run_id TEXT NOT NULL,
+            ts REAL NOT NULL,
+            device TEXT NOT NULL,
+            ip TEXT,
+            site_id INTEGER,
+            site TEXT,
+            valid INTEGER NOT NULL,
+            upload INTEGER,
+            download INTEGER,
+            contractual INTEGER,
+            retransmits INTEGER,
+            interval_count INTEGER,
+            interval_min INTEGER,
+            interval_max INTEGER,
+            interval_mean INTEGER,
+            interval_stdev INTEGER
+        )''',
+        'CREATE INDEX IF NOT EXISTS idx_tests_device_ts ON tests (device, ts)',
+        'CREATE INDEX IF NOT EXISTS idx_tests_site_ts ON tests (site, ts)',
+        'CREATE INDEX IF NOT EXISTS idx_tests_ts ON tests (ts)',
+        'CREATE INDEX IF NOT EXISTS idx_tests_ip_ts ON tests (ip, ts)',
+    ]
+
+    def __init__(self, db_file):
+        ''' Local SQLite store of all speed-test results, one row per test.
+        '''
+        directory = os.path.dirname(db_file)
+        if directory and not os.path.exists(directory):
+            os.makedirs(directory)
+        self.db_file = db_file
+        self.connection = sqlite3.connect(db_file)
+        self.connection.row_factory = sqlite3.Row
+        self.connection.execute('PRAGMA journal_mode=WAL')
+        for statement in self.SCHEMA:
+            self.connection.execute(statement)
+        self.connection.commit()
+
+    def check_field(self, field):
+        if field not in self.FIELDS:
+            raise ValueError(f"Unknown field { field }, use one of { self.FIELDS }.")
+
+    def close(self):
+        self.connection.close()
+
+    def record(self, run_id, ip, host, site, result, valid, ts=None):
+        ''' Store one test result as produced by parse_device_output().
+            Input: site (Netbox site dictionary or None)
+        '''
+        intervals = result.get('intervals') or {}
+        self.connection.execute(
+            '''INSERT INTO tests (run_id, ts, device, ip, site_id, site, valid, upload, download,
+                contractual, retransmits, interval_count, interval_min, interval_max,
+                interval_mean, interval_stdev)
+               VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?)''',
+            (run_id, ts or time.time(), host, ip,
+             site.get('id') if site else None, site.get('name') if site else None,
+             int(valid), to_int(result.get('upload')), to_int(result.get('download')),
+             to_int(result.get('download_contractual')), to_int(result.get('retransmits')),
+             to_int(intervals.get('count')), to_int(intervals.get('min')),
+             to_int(intervals.get('max')), to_int(intervals.get('mean')),
+             to_int(intervals.get('stdev'))))
+        self.connection.commit()
+
+    def last_tests(self):
+        ''' Latest test of every device.
+            Output: {ip: row with ts, valid, upload, download, contractual}
+        '''
+        # SQLite takes the bare columns from the row holding MAX(ts)
+        rows = self.connection.execute(
+            '''SELECT ip, MAX(ts) AS ts, valid, upload, download, contractual FROM tests
+               WHERE ip IS NOT NULL GROUP BY ip''')
+        return {row['ip']: row for row in rows}
+
+    def site_trend(self, site, since=0):
+        ''' Valid tests of a site ordered by time.
+        '''
+        return self.connection.execute(
+            '''SELECT ts, device, upload, download, contractual, retransmits FROM tests
+               WHERE site = ? AND ts >= ? AND valid = 1 ORDER BY ts''',
+            (site, since)).fetchall()
+
+    def rolling_median(self, site, window=3, since=0, field='download'):
+        ''' Rolling median of field over the last `window` tests of a site.
+            Output: list of (ts, value, rolling median)
+        '''
+        self.check_field(field)
+        rows = self.site_trend(site, since)
+        output = []
+        for i, row in enumerate(rows):
+            values = [r[field] for r in rows[max(0, i - window + 1):i + 1] if r[field] is not None]
+            output.append((row['ts'], row[field], median(values) if values else None))
+        return output
+
+    def percentiles(self, since=0, site=None, field='download', percents=(5, 50, 95)):
+        ''' Percentiles of field per site.
+            Output: {site: {'tests': n, 'p5': ..., 'p50': ..., 'p95': ...}}
+        '''
+        self.check_field(field)
+        query = f'SELECT site, { field } AS value FROM tests WHERE ts >= ? AND valid = 1'
+        params = [since]
+        if site is not None:
+            query += ' AND site = ?'
+            params.append(site)
+        values = {}
+        for row in self.connection.execute(query, params):
+            if row['value'] is not None:
+                values.setdefault(row['site'], []).append(row['value'])
+        return {
+            name: dict({'tests': len(site_values)},
+                       **{f"p{ p }": percentile(site_values, p) for p in percents})
+            for name, site_values in values.items()
+        }
+
+    def worst_offenders(self, since=0, limit=10, field='download'):
+        ''' Sites with the lowest median of field relative to the contractual speed.
+        Failed tests count as 0 bps.
+            Output: list of {'site', 'tests', 'failed', 'median', 'contractual', 'ratio'}
+        '''
+        self.check_field(field)
+        rows = self.connection.execute(
+            f'''SELECT site, valid, { field } AS value, contractual FROM tests
+                WHERE ts >= ? AND site IS NOT NULL''', (since,))
+        sites = {}
+        for row in rows:
+            site = sites.setdefault(row['site'], {'values': [], 'failed': 0, 'contractual': None})
+            if row['valid'] and row['value'] is not None:
+                site['values'].append(row['value'])
+            else:
+                site['values'].append(0)
+                site['failed'] += 1
+            if row['contractual']:
+                site['contractual'] = row['contractual']
+        offenders = []
+        for name, site in sites.items():
+            if not site['contractual']:
+                continue
+            site_median = median(site['values'])
+            offenders.append({
+                'site': name,
+                'tests': len(site['values']),
+                'failed': site['failed'],
+                'median': site_median,
+                'contractual': site['contractual'],
+                'ratio': round(site_median / site['contractual'], 3),
+            })
+        offenders.sort(key=lambda offender: offender['ratio'])
+        return offenders[:limit]
@@ -0,0 +1,138 @@
+import errno
+import socket
+import time
+from multiprocessing import Process, Queue
+from queue import Empty
+from Libs.Functions import Logger
+
+
+def serve_forever(bind_address, port, results):
+    ''' Run iperf3 server on port for the whole run, one test after another.
+    Every finished test is reported to the results queue.
+    '''
+    # libiperf is loaded through ctypes, only by the server processes
+    import iperf3
+    server = iperf3.Server()
+    server.bind_address = f'{bind_address}'
+    server.port = f'{port}'
+    server.verbose = False
+    while True:
+        result = server.run()
+        if result is None:
+            continue
+        results.put({
+            'port': port,
+            'time': time.time(),
+            'error': result.error,
+            'remote_host': None if result.error else result.remote_host,
+            'json': result.json,
+        })
+        if result.error:
+            # do not spin when the server keeps failing, e.g. on bind errors
+            time.sleep(0.1)
+
+
+class IperfServerManager:
+
+    def __init__(self, bind_address, ports, ready_timeout=10):
+        ''' One persistent iperf3 server process per port.
+        Servers are probed for readiness instead of waiting a fixed time
+        and restarted when they crash.
+        '''
+        self.bind_address = bind_address
+        self.ports = [int(port) for port in ports]
+        self.ready_timeout = ready_timeout
+        self.results = Queue()
+        self.servers = {}
+
+    def start(self):
+        ''' Start servers on all ports.
+            Output: list of ports with a listening server
+        '''
+        logger = Logger().get_logger()
+        for port in self.ports:
+            self.start_server(port)
+        ready = [port for port in self.ports if self.wait_ready(port)]
+        logger.debug(f"  ... Iperf3 Servers listening on ports { ready }.")
+        return ready
+
+    def start_server(self, port):
+        proc = Process(target=serve_forever, args=(self.bind_address, port, self.results),
+                       daemon=True)
+        proc.start()
+        self.servers[port] = proc
+
+    def probe(self, port):
+        ''' Return True if something listens on bind_address:port.
+        The probe tries to bind the port itself with SO_REUSEADDR, which fails
+        only while the port is held by a listening socket (not by TIME_WAIT ones).
+        Unlike a connect() probe, it does not consume a test of the
+        single-test iperf3 server.
+        It cannot tell which process listens: another program on the port, also one
+        bound to 0.0.0.0, passes the probe as well. wait_ready() therefore also
+        requires the server process of the port to be alive.
+        '''
+        sock = socket.socket(socket.AF_INET, socket.SOCK_STREAM)
+        sock.setsockopt(socket.SOL_SOCKET, socket.SO_REUSEADDR, 1)
+        try:
+            sock.bind((self.bind_address, port))
+        except OSError as e:
+            return e.errno == errno.EADDRINUSE
+        finally:
+            sock.close()
+        return False
+
+    def wait_ready(self, port):
+        ''' Poll the port until the server listens or ready_timeout expires.
+        '''
+        logger = Logger().get_logger()
+        deadline = time.time() + self.ready_timeout
+        while time.time() < deadline:
+            if not self.servers[port].is_alive():
+                break
+            if self.probe(port):
+                return True
+            time.sleep(0.05)
+        logger.error(f"Iperf3 Server on port { port } is not listening.")
+        return False
+
+    def restart(self, port):
+        ''' Replace the server on port, e.g. after a crash or
+        when it is stuck in a test of a terminated client.
+        '''
+        logger = Logger().get_logger()
+        logger.debug(f"  ... Restarting Iperf3 Server on port { port }.")
+        proc = self.servers.get(port)
+        if proc is not None and proc.is_alive():
+            proc.terminate()
+            proc.join(timeout=1)
+        self.start_server(port)
+        return self.wait_ready(port)
+
+    def ensure_running(self):
+        ''' Restart servers which are no longer alive.
+        '''
+        logger = Logger().get_logger()
+        for port, proc in list(self.servers.items()):
+            if not proc.is_alive():
+                logger.error(f"Iperf3 Server on port { port } exited with code { proc.exitcode }.")
+                self.restart(port)
+
+    def get_results(self):
+        ''' Drain finished test results without blocking.
+            Output: list of result dictionaries
+        '''
+        results = []
+        while True:
+            try:
+                results.append(self.results.get_nowait())
+            except Empty:
+                return results
+
+    def stop(self):
+        for proc in self.servers.values():
+            if proc.is_alive():
+                proc.terminate()
+        for proc in self.servers.values():
+            proc.join(timeout=1)
+        self.servers = {}
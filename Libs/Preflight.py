@@ -0,0 +1,65 @@
+import asyncio
+import time
+from Libs.Functions import Logger
+
+
+async def probe_tcp(ip, port, timeout):
+    ''' Return True if a TCP connection to ip:port opens within timeout.
+    '''
+    try:
+        reader, writer = await asyncio.wait_for(asyncio.open_connection(ip, port), timeout)
+    except (OSError, asyncio.TimeoutError):
+        return False
+    writer.close()
+    try:
+        await writer.wait_closed()
+    except OSError:
+        pass
+    return True
+
+
+async def probe_icmp(ip, timeout):
+    ''' Return True if a single ping of ip is answered within timeout.
+    '''
+    try:
+        process = await asyncio.create_subprocess_exec(
+            "ping", "-c", "1", "-q", "-W", str(max(1, int(timeout))), ip,
+            stdout=asyncio.subprocess.DEVNULL, stderr=asyncio.subprocess.DEVNULL)
+        return await asyncio.wait_for(process.wait(), timeout + 1) == 0
+    except (OSError, asyncio.TimeoutError):
+        return False
+
+
+async def sweep(ips, port, timeout, concurrency, icmp=False):
+    ''' Probe all ips concurrently, at most `concurrency` at once.
+        Output: {ip: {'ssh': bool, 'icmp': bool or None}}
+    '''
+    semaphore = asyncio.Semaphore(concurrency)
+
+    async def probe(ip):
+        async with semaphore:
+            ssh, ping = await asyncio.gather(
+                probe_tcp(ip, port, timeout),
+                probe_icmp(ip, timeout) if icmp else asyncio.sleep(0, result=None))
+            return ip, {'ssh': ssh, 'icmp': ping}
+
+    return dict(await asyncio.gather(*[probe(ip) for ip in ips]))
+
+
+def run_preflight(clients_lst, preflight):
+    ''' Sweep clients (IPs with or without prefix length) before any test is scheduled.
+        Input: preflight (inputVars.preflight settings)
+        Output: reachable clients (list), unreachable clients with their probe status (dictionary)
+    '''
+    logger = Logger().get_logger()
+    time_start = time.time()
+    ips = {client_ip: client_ip.split('/')[0] for client_ip in clients_lst}
+    status = asyncio.run(sweep(sorted(set(ips.values())), preflight.port, preflight.timeout,
+                               preflight.concurrency, preflight.icmp))
+    reachable = [client_ip for client_ip, ip in ips.items() if status[ip]['ssh']]
+    unreachable = {client_ip: status[ip] for client_ip, ip in ips.items() if not status[ip]['ssh']}
+    logger.debug(f"=== PRE-FLIGHT: { len(reachable) } REACHABLE, { len(unreachable) } UNREACHABLE "
+                 f"IN { round(time.time() - time_start, 2) } SECS.")
+    for client_ip in unreachable:
+        logger.error(f"{ client_ip } is not reachable on TCP/{ preflight.port }. Skipping.")
+    return reachable, unreachable
@@ -0,0 +1,50 @@
+import heapq
+import time
+from Libs.Functions import Logger
+
+# test order of an incremental run, most urgent first
+REASONS = ('untested', 'failed', 'sub_contract', 'stale', 'healthy')
+
+
+def classify(last_test, now, stale_after, sub_contract_ratio):
+    ''' Why a device should be tested, based on its last test.
+        Input: last_test (row of HistoryStore.last_tests() or None)
+        Output: reason (one of REASONS), order within the reason (lower first)
+    '''
+    if last_test is None:
+        return 'untested', 0
+    if not last_test['valid']:
+        return 'failed', last_test['ts']
+    measured = [value for value in (last_test['upload'], last_test['download']) if value is not None]
+    if last_test['contractual'] and measured:
+        ratio = min(measured) / last_test['contractual']
+        if ratio < sub_contract_ratio:
+            return 'sub_contract', ratio
+    if now - last_test['ts'] > stale_after:
+        return 'stale', last_test['ts']
+    return 'healthy', last_test['ts']
+
+
+def prioritize(clients_lst, last_tests, incremental, now=None):
+    ''' Order clients for an incremental run: untested, failed, below contract
+    (lowest ratio first), stale (oldest first), then healthy ones (oldest first).
+        Input: last_tests ({ip: last test} from HistoryStore.last_tests())
+               incremental (inputVars.incremental settings)
+        Output: clients in test order (list), {client: reason}
+    '''
+    logger = Logger().get_logger()
+    now = now or time.time()
+    heap = []
+    reasons = {}
+    for position, client_ip in enumerate(clients_lst):
+        reason, order = classify(last_tests.get(client_ip), now, incremental.stale_after,
+                                 incremental.sub_contract_ratio)
+        if reason == 'healthy' and not incremental.include_healthy:
+            continue
+        reasons[client_ip] = reason
+        heapq.heappush(heap, (REASONS.index(reason), order, position, client_ip))
+    ordered = [heapq.heappop(heap)[-1] for _ in range(len(heap))]
+    counts = {reason: list(reasons.values()).count(reason) for reason in REASONS}
+    logger.debug(f"=== INCREMENTAL RUN: { counts }, "
+                 f"{ len(clients_lst) - len(ordered) } HEALTHY DEVICES SKIPPED.")
+    return ordered, reasons
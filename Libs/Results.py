@@ -0,0 +1,113 @@
+import json
+import os
+import time
+from Libs.Functions import Logger
+
+
+class ResultStore:
+
+    def __init__(self, jsonl_file, resume=False):
+        ''' Append-only JSONL file with one record per tested device.
+        The file is the checkpoint of a run: with resume=True records of
+        a previous run are kept and devices with a valid record are skipped,
+        otherwise the file is started from scratch.
+        '''
+        self.jsonl_file = jsonl_file
+        self.records = {}
+        directory = os.path.dirname(jsonl_file)
+        if directory and not os.path.exists(directory):
+            os.makedirs(directory)
+        if resume:
+            self.load()
+        elif os.path.exists(jsonl_file):
+            os.remove(jsonl_file)
+
+    def load(self):
+        ''' Read records of a previous run, the last record of a device wins.
+        Lines which cannot be decoded (e.g. cut off by a crash) are ignored.
+        '''
+        logger = Logger().get_logger()
+        if not os.path.exists(self.jsonl_file):
+            return self.records
+        with open(self.jsonl_file, 'r') as file:
+            for line_number, line in enumerate(file, 1):
+                try:
+                    record = json.loads(line)
+                    self.records[record['ip']] = record
+                except (ValueError, KeyError, TypeError):
+                    logger.debug(f"  ... Skipping broken record { self.jsonl_file }:{ line_number }.")
+        logger.debug(f"  ... Loaded { len(self.records) } records from { self.jsonl_file }.")
+        return self.records
+
+    def append(self, ip, host, result, valid, series=None):
+        ''' Write a device record and flush it to disk right away.
+        series holds raw per-interval data kept out of the final output.
+        '''
+        record = {'ip': ip, 'host': host, 'time': time.time(), 'valid': valid, 'result': result,
+                  'series': series}
+        with open(self.jsonl_file, 'a') as file:
+            file.write(json.dumps(record)+"\n")
+            file.flush()
+            os.fsync(file.fileno())
+        self.records[ip] = record
+        return record
+
+    def merge(self, records):
+        ''' Add records of another store (e.g. of a shard) where they are newer,
+        written in one batch.
+        '''
+        newer = [record for record in records
+                 if record['ip'] not in self.records
+                 or record['time'] > self.records[record['ip']]['time']]
+        with open(self.jsonl_file, 'a') as file:
+            for record in newer:
+                file.write(json.dumps(record)+"\n")
+            file.flush()
+            os.fsync(file.fileno())
+        for record in newer:
+            self.records[record['ip']] = record
+        return len(newer)
+
+    def compact(self, clients_lst=None):
+        ''' Rewrite the file with the last record of every device, optionally
+        only of clients_lst, e.g. for a store kept across the runs of the service.
+        '''
+        if clients_lst is not None:
+            clients = set(clients_lst)
+            self.records = {ip: record for ip, record in self.records.items() if ip in clients}
+        with open(self.jsonl_file+".tmp", 'w') as file:
+            for record in self.records.values():
+                file.write(json.dumps(record)+"\n")
+            file.flush()
+            os.fsync(file.fileno())
+        os.replace(self.jsonl_file+".tmp", self.jsonl_file)
+
+    def is_done(self, ip):
+        record = self.records.get(ip)
+        return record is not None and record['valid']
+
+    def pending(self, clients_lst):
+        ''' Return clients without a valid record.
+        '''
+        return [ip for ip in clients_lst if not self.is_done(ip)]
+
+    def series_by_host(self, clients_lst=None):
+        ''' Return {hostname: series} of valid records, optionally limited to clients_lst.
+        '''
+        clients = None if clients_lst is None else set(clients_lst)
+        return {
+            record['host']: record.get('series')
+            for ip, record in self.records.items()
+            if record['valid'] and (clients is None or ip in clients)
+        }
+
+    def to_final_dict(self, clients_lst=None):
+        ''' Build the final output {hostname: result} from the records,
+        optionally limited to clients_lst.
+        '''
+        clients = None if clients_lst is None else set(clients_lst)
+        final_dct = {}
+        for ip, record in self.records.items():
+            if clients is None or ip in clients:
+                final_dct[record['host']] = record['result']
+        return final_dct
@@ -0,0 +1,145 @@
+import asyncio
+import random
+import threading
+import time
+
+
+def backoff_delay(attempt, base_delay, max_delay):
+    ''' Exponential backoff with full jitter: a random delay up to
+    base_delay * 2^(attempt-1) secs, capped at max_delay. Clients failing
+    at the same time do not come back at the same time.
+    '''
+    return random.uniform(0, min(max_delay, base_delay * 2 ** (attempt - 1)))
+
+
+class CircuitOpenError(Exception):
+    ''' Raised instead of calling a service whose circuit breaker is open.
+    '''
+
+
+class CircuitBreaker:
+
+    def __init__(self, threshold=5, reset_timeout=60):
+        ''' Stop calling a service which keeps failing.
+        After `threshold` transient failures in a row the circuit opens and calls
+        fail fast for reset_timeout secs. Then a single trial call is let through,
+        its success closes the circuit, its failure opens it again.
+        '''
+        self.threshold = threshold
+        self.reset_timeout = reset_timeout
+        self.failures = 0
+        self.opened = None
+        self.trial = False
+        self.lock = threading.Lock()
+
+    def state(self):
+        if self.opened is None:
+            return 'closed'
+        if time.time() - self.opened >= self.reset_timeout:
+            return 'half_open'
+        return 'open'
+
+    def allow(self):
+        with self.lock:
+            state = self.state()
+            if state == 'closed':
+                return True
+            if state == 'half_open' and not self.trial:
+                self.trial = True
+                return True
+            return False
+
+    def success(self):
+        with self.lock:
+            self.failures = 0
+            self.opened = None
+            self.trial = False
+
+    def failure(self):
+        with self.lock:
+            self.failures += 1
+            self.trial = False
+            if self.failures >= self.threshold:
+                self.opened = time.time()
+
+
+class RetryPolicy:
+
+    def __init__(self, attempts, base_delay=1, max_delay=30, transient=None, breaker=None,
+                 on_retry=None, stop=None):
+        ''' Call a function until it succeeds, at most `attempts` times.
+        Only errors classified as transient are retried, after backoff_delay() secs,
+        permanent errors and the last transient one are raised to the caller.
+        Retries are counted in self.retries.
+            Input: transient (callable(exception) returning True for transient errors,
+                              default all errors are transient)
+                   breaker (optional CircuitBreaker, CircuitOpenError is raised while it is open)
+                   on_retry (optional callable(attempt, exception, delay) run before a retry)
+                   stop (optional threading.Event, once set the error is raised
+                         instead of waiting for the next attempt)
+        '''
+        self.attempts = max(1, int(attempts))
+        self.base_delay = base_delay
+        self.max_delay = max_delay
+        self.transient = transient or (lambda error: True)
+        self.breaker = breaker
+        self.on_retry = on_retry
+        self.stop = stop
+        self.retries = 0
+
+    def before_attempt(self):
+        if self.breaker is not None and not self.breaker.allow():
+            raise CircuitOpenError(f"circuit open for { self.breaker.reset_timeout } secs "
+                                   f"after { self.breaker.failures } failures")
+
+    def after_success(self):
+        if self.breaker is not None:
+            self.breaker.success()
+
+    def after_failure(self, attempt, error):
+        ''' Re-raise a permanent or the last error, otherwise return the delay
+        before the next attempt.
+        '''
+        transient = self.transient(error)
+        # a permanent error (e.g. 403 or 404) is an answer of the service,
+        # it closes the circuit like a success, also after a half-open trial
+        if self.breaker is not None:
+            if transient:
+                self.breaker.failure()
+            else:
+                self.breaker.success()
+        if not transient or attempt >= self.attempts:
+            raise error
+        delay = backoff_delay(attempt, self.base_delay, self.max_delay)
+        self.retries += 1
+        if self.on_retry is not None:
+            self.on_retry(attempt, error, delay)
+        return delay
+
+    def call(self, function, *args, **kwargs):
+        for attempt in range(1, self.attempts + 1):
+            self.before_attempt()
+            try:
+                result = function(*args, **kwargs)
+            except Exception as e:
+                delay = self.after_failure(attempt, e)
+                if self.stop is None:
+                    time.sleep(delay)
+                elif self.stop.wait(delay):
+                    raise
+                continue
+            self.after_success()
+            return result
+
+    async def call_async(self, function, *args, **kwargs):
+        ''' Same as call() for a coroutine function.
+        '''
+        for attempt in range(1, self.attempts + 1):
+            self.before_attempt()
+            try:
+                result = await function(*args, **kwargs)
+            except Exception as e:
+                await asyncio.sleep(self.after_failure(attempt, e))
+                continue
+            self.after_success()
+            return result
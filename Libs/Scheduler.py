@@ -0,0 +1,257 @@
+import heapq
+import time
+from collections import deque
+from Libs.Functions import Logger
+
+
+class PortPool:
+
+    def __init__(self, ports):
+        ''' Pool of iperf3 server ports.
+        Every test in flight leases its own port, so parallel tests
+        never share a listening iperf3 server.
+        '''
+        self.free = deque(int(port) for port in ports)
+        self.leased = {}
+
+    def lease(self, owner):
+        ''' Return a free port for owner or None if the pool is exhausted.
+        '''
+        if not self.free:
+            return None
+        port = self.free.popleft()
+        self.leased[port] = owner
+        return port
+
+    def release(self, port):
+        ''' Return a leased port back to the pool.
+        '''
+        if self.leased.pop(port, None) is not None:
+            self.free.append(port)
+
+    def remove(self, port):
+        ''' Take a port out of the pool for good, e.g. when its server is down.
+        '''
+        self.leased.pop(port, None)
+        if port in self.free:
+            self.free.remove(port)
+
+    def __len__(self):
+        return len(self.free) + len(self.leased)
+
+
+class BandwidthBudget:
+
+    def __init__(self, capacity):
+        ''' Uplink capacity (bps) of the iperf3 server shared by all tests in flight.
+        A test is admitted only while the demands in flight fit in the capacity,
+        a demand larger than the whole capacity is admitted alone.
+        '''
+        self.capacity = capacity
+        self.reserved = {}
+
+    def used(self):
+        return sum(self.reserved.values())
+
+    def fits(self, demand):
+        return not self.reserved or self.used() + demand <= self.capacity
+
+    def reserve(self, owner, demand):
+        self.reserved[owner] = demand
+
+    def release(self, owner):
+        self.reserved.pop(owner, None)
+
+
+class TestScheduler:
+
+    def __init__(self, port_pool, concurrency, timeout=240, poll_interval=0.2, budget=None, grace=5):
+        ''' Keep up to `concurrency` tests in flight.
+        Each test gets a port leased from port_pool, the port is released
+        as soon as the test finishes or is terminated on timeout.
+        With a BandwidthBudget, tests are also admitted only while their
+        demands fit in it, see run().
+        A terminated test has `grace` secs to stop on its own before it is killed,
+        it keeps its port until it has stopped.
+        '''
+        self.port_pool = port_pool
+        self.concurrency = max(1, min(int(concurrency), len(port_pool)))
+        self.timeout = timeout
+        self.poll_interval = poll_interval
+        self.budget = budget
+        self.grace = grace
+        self.in_flight = {}
+        # terminated jobs: {job: time after which they are killed, None once killed}
+        self.stopping = {}
+        self.durations = []
+        self.not_started = []
+
+    def next_job(self, pending, demands):
+        ''' First pending job which fits in the budget, None if none does.
+        '''
+        if self.budget is None:
+            return pending[0]
+        for job in pending:
+            if self.budget.fits(demands[job]):
+                return job
+        return None
+
+    def past_deadline(self, deadline):
+        ''' True if a job started now would not finish before deadline,
+        judged by the mean duration of the jobs finished so far.
+        '''
+        if deadline is None:
+            return False
+        expected = sum(self.durations) / len(self.durations) if self.durations else 0
+        return time.time() + expected > deadline
+
+    def run(self, jobs, launch, poll=None, on_timeout=None, on_finish=None, demand=None,
+            ordered=False, deadline=None):
+        ''' Run all jobs.
+            Input: jobs (iterable of job keys, e.g. client IPs)
+                   launch (callable(job, port) returning list of started Processes,
+                           the job is finished once the last Process exits)
+                   poll (optional callable() run on every scheduler tick)
+                   on_timeout (optional callable(job, port) run after a terminated job stopped)
+                   on_finish (optional callable(job) run after every job, terminated or not)
+                   demand (callable(job) returning its bandwidth in bps, required with a budget)
+                   ordered (keep the order of jobs, e.g. a priority order)
+                   deadline (optional timestamp, no job is started which is not expected
+                             to finish by then, those are left in self.not_started)
+            Output: list of jobs which had to be terminated on timeout
+        With a budget, jobs are ordered by demand, largest first, and every free slot
+        takes the largest job which still fits, so small circuits fill the capacity
+        left next to large ones. With ordered=True the slot takes the first job
+        which fits instead.
+        '''
+        logger = Logger().get_logger()
+        pending = deque(jobs)
+        demands = {}
+        if self.budget is not None:
+            demands = {job: demand(job) for job in pending}
+            if not ordered:
+                pending = deque(sorted(pending, key=demands.get, reverse=True))
+        timed_out = []
+        while pending or self.in_flight:
+            if pending and self.past_deadline(deadline):
+                logger.debug(f"  ... Time budget exhausted, { len(pending) } jobs not started.")
+                self.not_started.extend(pending)
+                pending.clear()
+            if pending and not self.in_flight and not len(self.port_pool):
+                logger.error(f"No port left in the pool, { len(pending) } jobs not started.")
+                self.not_started.extend(pending)
+                pending.clear()
+            while pending and len(self.in_flight) < self.concurrency:
+                job = self.next_job(pending, demands)
+                if job is None:
+                    break
+                port = self.port_pool.lease(job)
+                if port is None:
+                    break
+                pending.remove(job)
+                if self.budget is not None:
+                    self.budget.reserve(job, demands[job])
+                    logger.debug(f"  ... Scheduling { job } on port { port }, "
+                                 f"{ self.budget.used() // 1000000 }/{ self.budget.capacity // 1000000 } "
+                                 f"Mbps of the uplink budget in flight.")
+                else:
+                    logger.debug(f"  ... Scheduling { job } on port { port }.")
+                self.in_flight[job] = (port, launch(job, port), time.time())
+            if poll is not None:
+                poll()
+            for job in list(self.in_flight):
+                port, processes, time_start = self.in_flight[job]
+                if job in self.stopping:
+                    if self.stopped(job):
+                        del self.stopping[job]
+                        self.finish(job)
+                        if on_timeout is not None:
+                            on_timeout(job, port)
+                        if on_finish is not None:
+                            on_finish(job)
+                elif not processes[-1].is_alive():
+                    self.finish(job)
+                    if on_finish is not None:
+                        on_finish(job)
+                elif time.time() - time_start > self.timeout:
+                    # ask all expired jobs to stop, they are reaped on later ticks
+                    logger.error(f"Process taking too long. Skipping { job }.")
+                    for proc in processes:
+                        if proc.is_alive():
+                            proc.terminate()
+                    timed_out.append(job)
+                    self.stopping[job] = time.time() + self.grace
+            if self.in_flight:
+                time.sleep(self.poll_interval)
+        return timed_out
+
+    def simulate(self, jobs, duration, demand=None, ordered=False, time_budget=0):
+        ''' Dry run of run() on a virtual clock, every job takes `duration` secs.
+        Ports and the budget are leased in the same order as in a real run.
+            Input: time_budget (secs, no job is started which would not finish by then, 0 for no limit)
+            Output: {job: {'port', 'start' (secs from the start)}}, run time (secs), jobs not started
+        '''
+        pending = deque(jobs)
+        demands = {}
+        if self.budget is not None:
+            demands = {job: demand(job) for job in pending}
+            if not ordered:
+                pending = deque(sorted(pending, key=demands.get, reverse=True))
+        clock = 0
+        in_flight = []
+        assignments = {}
+        not_started = []
+        while pending or in_flight:
+            if pending and time_budget and clock + duration > time_budget:
+                not_started.extend(pending)
+                pending.clear()
+            while pending and len(in_flight) < self.concurrency:
+                job = self.next_job(pending, demands)
+                if job is None:
+                    break
+                port = self.port_pool.lease(job)
+                if port is None:
+                    break
+                pending.remove(job)
+                if self.budget is not None:
+                    self.budget.reserve(job, demands[job])
+                assignments[job] = {'port': port, 'start': clock}
+                heapq.heappush(in_flight, (clock + duration, len(assignments), job, port))
+            if not in_flight:
+                break
+            clock, _, job, port = heapq.heappop(in_flight)
+            self.port_pool.release(port)
+            if self.budget is not None:
+                self.budget.release(job)
+        return assignments, clock, not_started
+
+    def stopped(self, job):
+        ''' True once all processes of a terminated job have exited.
+        A process still running after the grace period is killed: killed right away,
+        in the middle of a log record, it could leave the queue shared by all tests locked.
+        '''
+        logger = Logger().get_logger()
+        alive = [proc for proc in self.in_flight[job][1] if proc.is_alive()]
+        if alive and self.stopping[job] is not None and time.time() >= self.stopping[job]:
+            logger.error(f"{ job } did not stop within { self.grace } secs, killing it.")
+            for proc in alive:
+                proc.kill()
+            self.stopping[job] = None
+        return not alive
+
+    def finish(self, job):
+        ''' Reap processes of a finished job and release its port.
+        '''
+        logger = Logger().get_logger()
+        port, processes, time_start = self.in_flight.pop(job)
+        self.durations.append(time.time() - time_start)
+        for proc in processes:
+            proc.join(timeout=1)
+            if proc.is_alive():
+                proc.terminate()
+                proc.join(timeout=1)
+        self.port_pool.release(port)
+        if self.budget is not None:
+            self.budget.release(job)
+        logger.debug(f"  ... { job } finished in { round(time.time() - time_start, 2) } secs, "
+                     f"port { port } released.")
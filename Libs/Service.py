@@ -0,0 +1,178 @@
+import json
+import os
+import threading
+import time
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from queue import Queue, Empty
+from socketserver import ThreadingMixIn, UnixStreamServer
+from Libs.Functions import Logger
+
+
+class TestThread(threading.Thread):
+
+    def __init__(self, target, args, abort):
+        ''' Test of one device in a thread of the service process.
+        Stands in for the Process of one-shot runs in TestScheduler,
+        terminate() calls abort(), which makes the connect, its retries and
+        the reads of the test fail. The scheduler keeps the port of the test
+        and records it only once the thread has ended.
+        '''
+        super().__init__(target=target, args=args, daemon=True)
+        self.abort = abort
+
+    def terminate(self):
+        self.abort()
+
+    # a thread cannot be killed, it ends with its aborted read
+    kill = terminate
+
+
+class UnixHTTPServer(ThreadingMixIn, UnixStreamServer):
+    daemon_threads = True
+
+
+class Service:
+
+    def __init__(self, run, interval=0, incremental=False):
+        ''' Resident test service.
+        Runs are queued by the internal schedule (every `interval` secs, 0 disables it)
+        or through the API and executed one after another by serve_forever().
+            Input: run (callable(request) returning a summary dictionary of the run)
+        '''
+        self.run = run
+        self.interval = interval
+        self.incremental = incremental
+        self.queue = Queue()
+        self.running = False
+        self.next_run = time.time() if interval else None
+        self.current = None
+        self.last_run = None
+        self.sequence = 0
+        self.lock = threading.Lock()
+
+    def submit(self, request):
+        ''' Queue a run.
+            Input: request (dictionary: 'clients' and 'sites' limit the run, 'incremental')
+            Output: request ID
+        '''
+        with self.lock:
+            self.sequence += 1
+            request = dict(request, id=self.sequence, queued=time.time())
+        self.queue.put(request)
+        return request['id']
+
+    def status(self):
+        return {
+            'state': "running" if self.current else "idle",
+            'current': self.current,
+            'queued': self.queue.qsize(),
+            'next_run': self.next_run,
+            'last_run': self.last_run,
+        }
+
+    def serve_forever(self, housekeeping=None, tick=1):
+        ''' Execute queued runs until stop() is called.
+        housekeeping() is called every `tick` secs while no run is in progress.
+        '''
+        logger = Logger().get_logger()
+        self.running = True
+        while self.running:
+            if self.next_run is not None and time.time() >= self.next_run:
+                self.submit({'trigger': "schedule", 'incremental': self.incremental})
+                self.next_run = time.time() + self.interval
+            try:
+                request = self.queue.get(timeout=tick)
+            except Empty:
+                if housekeeping is not None:
+                    housekeeping()
+                continue
+            self.current = dict(request, started=time.time())
+            logger.debug(f"### SERVICE RUN { request['id'] } STARTED: { request }")
+            try:
+                summary = self.run(request)
+            except Exception as e:
+                logger.error(f"Service run { request['id'] } failed: { e }")
+                summary = {'error': str(e)}
+            self.last_run = dict(self.current, finished=time.time(), **summary)
+            self.current = None
+            logger.debug(f"### SERVICE RUN { request['id'] } COMPLETED: { self.last_run }")
+
+    def stop(self):
+        self.running = False
+
+
+def parse_request(body):
+    ''' Validate the JSON body of POST /run.
+        Output: request (dictionary)
+    '''
+    request = json.loads(body or "{}")
+    if not isinstance(request, dict):
+        raise ValueError("request must be a JSON object")
+    for key in ('clients', 'sites'):
+        if not isinstance(request.get(key, []), list):
+            raise ValueError(f"{ key } must be a list")
+    return {'trigger': "api", 'clients': request.get('clients', []),
+            'sites': request.get('sites', []), 'incremental': bool(request.get('incremental'))}
+
+
+def start_api(listen, service, output_file, extra_status=None):
+    ''' Local HTTP API of the service in a background thread.
+        Input: listen ('host:port' or 'unix:/path/to/socket')
+               extra_status (optional callable() adding to GET /status)
+    GET /status, GET /results (last result of every device), POST /run (queue a run).
+    '''
+    logger = Logger().get_logger()
+
+    class Handler(BaseHTTPRequestHandler):
+
+        def log_message(self, format, *args):
+            logger.debug(f"  ... API: { format % args }")
+
+        def reply(self, code, data):
+            body = json.dumps(data, indent=4).encode()
+            self.send_response(code)
+            self.send_header('Content-Type', "application/json")
+            self.send_header('Content-Length', str(len(body)))
+            self.end_headers()
+            self.wfile.write(body)
+
+        def do_GET(self):
+            if self.path == "/status":
+                status = service.status()
+                if extra_status is not None:
+                    status.update(extra_status())
+                self.reply(200, status)
+            elif self.path == "/results":
+                try:
+                    with open(output_file, 'r') as file:
+                        self.reply(200, json.load(file))
+                except (OSError, ValueError):
+                    self.reply(404, {'error': "no results yet"})
+            else:
+                self.reply(404, {'error': "not found"})
+
+        def do_POST(self):
+            if self.path != "/run":
+                self.reply(404, {'error': "not found"})
+                return
+            length = int(self.headers.get('Content-Length') or 0)
+            try:
+                request = parse_request(self.rfile.read(length).decode())
+            except ValueError as e:
+                self.reply(400, {'error': str(e)})
+                return
+            self.reply(202, {'id': service.submit(request)})
+
+    if listen.startswith("unix:"):
+        socket_path = listen[len("unix:"):]
+        if os.path.exists(socket_path):
+            os.remove(socket_path)
+        server = UnixHTTPServer(socket_path, Handler)
+        # BaseHTTPRequestHandler expects (host, port) of the client
+        Handler.address_string = lambda handler: socket_path
+    else:
+        host, port = listen.rsplit(':', 1)
+        server = ThreadingHTTPServer((host, int(port)), Handler)
+    threading.Thread(target=server.serve_forever, daemon=True).start()
+    logger.debug(f"  ... Service API listening on { listen }.")
+    return server
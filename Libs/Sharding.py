@@ -0,0 +1,102 @@
+import bisect
+import hashlib
+import json
+import os
+from Libs.Functions import Logger
+from Libs.Results import ResultStore
+
+STRATEGIES = ('hash', 'region')
+
+
+def ring_hash(key):
+    return int.from_bytes(hashlib.md5(key.encode()).digest()[:8], 'big')
+
+
+class HashRing:
+
+    def __init__(self, nodes, vnodes=64):
+        ''' Consistent hashing of devices to nodes.
+        Every node owns `vnodes` points of the ring, a device belongs to the node
+        of the first point after its hash. Adding or removing a node only moves
+        the devices of that node.
+        '''
+        self.points = sorted((ring_hash(f"{ node }#{ i }"), node)
+                             for node in nodes for i in range(vnodes))
+        self.hashes = [point for point, _ in self.points]
+
+    def node(self, key):
+        index = bisect.bisect(self.hashes, ring_hash(key)) % len(self.points)
+        return self.points[index][1]
+
+
+def get_device_region(device, inventory):
+    ''' Netbox region ID of the device site, None if the site has no region.
+    '''
+    site = inventory.get_site(device['site']['id']) if device.get('site') else None
+    return ((site or {}).get('region') or {}).get('id')
+
+
+def assign_shards(devices, inventory, sharding):
+    ''' Split devices across the collector nodes.
+    With strategy 'hash' devices are spread over all nodes by consistent hashing of their name.
+    With 'region' a device goes to a node listing the region of its site (hashed among them
+    if several do), devices of regions without a node are hashed over all nodes.
+        Input: devices (list of Netbox device JSONs), sharding (inputVars.sharding)
+        Output: {node name: [devices]}
+    '''
+    if sharding.strategy not in STRATEGIES:
+        raise ValueError(f"sharding.strategy must be one of { STRATEGIES }, not { sharding.strategy }")
+    names = [node['name'] for node in sharding.nodes]
+    ring = HashRing(names, sharding.vnodes)
+    region_rings = {}
+    if sharding.strategy == 'region':
+        for node in sharding.nodes:
+            for region_id in node.get('regions') or []:
+                region_rings.setdefault(region_id, []).append(node['name'])
+        region_rings = {region_id: HashRing(nodes, sharding.vnodes)
+                        for region_id, nodes in region_rings.items()}
+    shards = {name: [] for name in names}
+    for device in devices:
+        device_ring = region_rings.get(get_device_region(device, inventory), ring)
+        shards[device_ring.node(device['name'])].append(device)
+    return shards
+
+
+def get_shard_devices(inventory, sharding, node):
+    ''' Devices of the inventory tested by `node`, all devices if node is empty.
+    '''
+    logger = Logger().get_logger()
+    if not node:
+        return inventory.devices
+    names = [shard_node['name'] for shard_node in sharding.nodes]
+    if node not in names:
+        raise ValueError(f"Shard { node } is not one of sharding.nodes { names }")
+    shards = assign_shards(inventory.devices, inventory, sharding)
+    logger.debug(f"=== SHARD { node }: { len(shards[node]) } OF { len(inventory.devices) } DEVICES, "
+                 f"{ { name: len(devices) for name, devices in shards.items() } }.")
+    return shards[node]
+
+
+def merge_shards(output_files, output_file):
+    ''' Combine the results of the nodes into one result set.
+    Per-device records of OUTPUT_FILE.jsonl of a node are preferred, the newer record
+    of a device wins. A node without its .jsonl contributes its final JSON as it is.
+        Input: output_files (-o files of the nodes), output_file (merged -o file)
+        Output: merged store (ResultStore of output_file.jsonl), hosts of final JSON files
+    '''
+    logger = Logger().get_logger()
+    merged = ResultStore(output_file+".jsonl")
+    final_hosts = {}
+    for filepath in output_files:
+        if os.path.exists(filepath+".jsonl"):
+            records = ResultStore(filepath+".jsonl", resume=True).records
+            merged.merge(records.values())
+            logger.debug(f"  ... Merged { len(records) } records of { filepath }.jsonl.")
+        elif os.path.exists(filepath):
+            with open(filepath, 'r') as file:
+                hosts = json.load(file)
+            final_hosts.update(hosts)
+            logger.debug(f"  ... Merged { len(hosts) } hosts of { filepath }.")
+        else:
+            logger.error(f"Shard output { filepath } not found.")
+    return merged, final_hosts
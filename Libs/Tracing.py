@@ -0,0 +1,185 @@
+import json
+import os
+import time
+from collections import Counter
+from contextlib import contextmanager
+from Libs.Functions import Logger
+from Libs.History import percentile
+
+PREFIX = "fortigate_iperf3"
+# counters exported even when zero, so alerts on them always have a series
+COUNTERS = {
+    'retries': ("operation", "Operations retried after a failure.",
+                ("netbox", "ssh_connect", "test", "iperf3_server")),
+    'timeouts': ("stage", "Operations aborted on timeout.",
+                 ("connect", "session", "scheduler")),
+    'ports_dropped': ("component", "Ports taken out of the pool after a failed restart.",
+                      ("iperf3_server",)),
+}
+
+
+def write_atomic(filepath, text):
+    ''' Write through a temporary file, readers never see a partial file.
+    '''
+    directory = os.path.dirname(filepath)
+    if directory and not os.path.exists(directory):
+        os.makedirs(directory)
+    tmp_file = filepath+".tmp"
+    with open(tmp_file, 'w') as file:
+        file.write(text)
+    os.replace(tmp_file, filepath)
+
+
+def last_device_secs(trace_file):
+    ''' Median wall time of a device test in a Chrome trace written by Tracer.write(),
+    None if there is no trace with device spans.
+    '''
+    try:
+        with open(trace_file, 'r') as file:
+            events = json.load(file)['traceEvents']
+    except (OSError, ValueError, KeyError, TypeError):
+        return None
+    durations = [event['dur'] / 1e6 for event in events
+                 if event.get('name') == "device" and event.get('ph') == "X"]
+    return percentile(durations, 50)
+
+
+class Tracer:
+
+    def __init__(self, run_id):
+        ''' Timed phases (spans) and counters of a run.
+        Spans of the test processes are written to <ip>.trace files
+        by run_iperf3_client and merged with load_device_trace().
+        '''
+        self.run_id = run_id
+        self.time_start = time.time()
+        self.spans = []
+        self.counters = Counter()
+
+    def add(self, name, start, duration, device=None, **args):
+        self.spans.append({'name': name, 'device': device, 'start': start,
+                           'duration': duration, 'args': args})
+
+    @contextmanager
+    def span(self, name, device=None, **args):
+        time_start = time.time()
+        try:
+            yield
+        finally:
+            self.add(name, time_start, time.time() - time_start, device, **args)
+
+    def count(self, name, label, value=1):
+        self.counters[(name, label)] += value
+
+    def load_device_trace(self, device, filepath):
+        ''' Merge spans and counters written by the test process of a device.
+            Output: trace data (dictionary, empty if there is none)
+        '''
+        logger = Logger().get_logger()
+        if not os.path.exists(filepath):
+            return {}
+        try:
+            with open(filepath, 'r') as file:
+                data = json.load(file)
+        except (OSError, ValueError) as e:
+            logger.debug(f"Cannot read trace { filepath }: { e }")
+            return {}
+        for span in data.get('spans', []):
+            self.add(span['name'], span['start'], span['duration'], device, **span.get('args', {}))
+        for name, labels in data.get('counters', {}).items():
+            for label, value in labels.items():
+                self.count(name, label, value)
+        return data
+
+    def phase_durations(self):
+        ''' Output: {span name: [durations of all devices]}
+        '''
+        phases = {}
+        for span in self.spans:
+            phases.setdefault(span['name'], []).append(span['duration'])
+        return phases
+
+    def chrome_trace(self):
+        ''' Spans as Chrome trace events, one thread per device ordered by start,
+        run-level spans on thread 0. Open in chrome://tracing or ui.perfetto.dev.
+        '''
+        first_start = {}
+        for span in self.spans:
+            if span['device'] is not None:
+                first_start[span['device']] = min(span['start'],
+                                                  first_start.get(span['device'], span['start']))
+        tids = {device: tid for tid, device in
+                enumerate(sorted(first_start, key=first_start.get), start=1)}
+        events = [
+            {'name': "process_name", 'ph': "M", 'pid': 1, 'tid': 0,
+             'args': {'name': f"run { self.run_id }"}},
+            {'name': "thread_name", 'ph': "M", 'pid': 1, 'tid': 0, 'args': {'name': "main"}},
+        ]
+        events += [{'name': "thread_name", 'ph': "M", 'pid': 1, 'tid': tid,
+                    'args': {'name': device}} for device, tid in tids.items()]
+        for span in sorted(self.spans, key=lambda span: span['start']):
+            events.append({
+                'name': span['name'],
+                'cat': "device" if span['device'] is not None else "run",
+                'ph': "X",
+                'ts': round((span['start'] - self.time_start) * 1e6),
+                'dur': round(span['duration'] * 1e6),
+                'pid': 1,
+                'tid': tids.get(span['device'], 0),
+                'args': span['args'],
+            })
+        return {
+            'traceEvents': events,
+            'displayTimeUnit': "ms",
+            'otherData': {
+                'run_id': self.run_id,
+                'counters': {f"{ name }.{ label }": value
+                             for (name, label), value in sorted(self.counters.items())},
+            },
+        }
+
+    def prometheus(self, devices):
+        ''' Run metrics in Prometheus text exposition format.
+            Input: devices (dictionary, state: number of devices)
+        '''
+        lines = [
+            f"# HELP { PREFIX }_phase_seconds Wall time of a test phase per device.",
+            f"# TYPE { PREFIX }_phase_seconds summary",
+        ]
+        for phase, durations in sorted(self.phase_durations().items()):
+            for quantile in (0.5, 0.95):
+                lines.append(f'{ PREFIX }_phase_seconds{{phase="{ phase }",quantile="{ quantile }"}} '
+                             f"{ round(percentile(durations, quantile * 100), 6) }")
+            lines.append(f'{ PREFIX }_phase_seconds_sum{{phase="{ phase }"}} { round(sum(durations), 6) }')
+            lines.append(f'{ PREFIX }_phase_seconds_count{{phase="{ phase }"}} { len(durations) }')
+        for name, (label_name, help_text, labels) in COUNTERS.items():
+            lines.append(f"# HELP { PREFIX }_{ name }_total { help_text }")
+            lines.append(f"# TYPE { PREFIX }_{ name }_total counter")
+            seen = set(labels) | {label for (counter, label) in self.counters if counter == name}
+            for label in sorted(seen):
+                lines.append(f'{ PREFIX }_{ name }_total{{{ label_name }="{ label }"}} '
+                             f"{ self.counters[(name, label)] }")
+        lines += [
+            f"# HELP { PREFIX }_devices Devices of the last run by state.",
+            f"# TYPE { PREFIX }_devices gauge",
+        ]
+        lines += [f'{ PREFIX }_devices{{state="{ state }"}} { count }'
+                  for state, count in sorted(devices.items())]
+        lines += [
+            f"# HELP { PREFIX }_run_duration_seconds Wall time of the last run.",
+            f"# TYPE { PREFIX }_run_duration_seconds gauge",
+            f"{ PREFIX }_run_duration_seconds { round(time.time() - self.time_start, 3) }",
+            f"# HELP { PREFIX }_last_run_timestamp_seconds Start of the last run.",
+            f"# TYPE { PREFIX }_last_run_timestamp_seconds gauge",
+            f"{ PREFIX }_last_run_timestamp_seconds { round(self.time_start, 3) }",
+        ]
+        return "\n".join(lines) + "\n"
+
+    def write(self, trace_file, prometheus_file, devices):
+        ''' Write the Chrome trace and the Prometheus textfile, a falsy filename skips it.
+        The textfile is replaced atomically as node_exporter's textfile collector requires.
+        '''
+        if trace_file:
+            write_atomic(trace_file, json.dumps(self.chrome_trace()))
+        if prometheus_file:
+            write_atomic(prometheus_file, self.prometheus(devices))
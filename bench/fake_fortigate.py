@@ -0,0 +1,217 @@
+import json
+import os
+import re
+import selectors
+import socket
+import subprocess
+import tempfile
+import threading
+import time
+import zlib
+import paramiko
+import paramiko.kex_group14
+
+STATUS = ("Version: FortiGate-60F v7.0.12,build0523,230613 (GA.M)\r\n"
+          "Virtual domain configuration: disable\r\n")
+CONSOLE = "output              : standard\r\n"
+# netmiko limits Fortinet key exchange to diffie-hellman-group*-sha1 and
+# group-exchange, recent paramiko only keeps group-exchange-sha256 of those.
+# Server-side group exchange needs a moduli file, serve the RFC 3526 2048-bit group.
+MODULI = f"20240101000000 2 6 100 2047 2 { paramiko.kex_group14.KexGroup14SHA256.P:X}\n"
+
+
+def make_iperf3_json(seed, duration=10, bps=95e6):
+    ''' Canned iperf3 -J document with per-interval data, slightly different per seed.
+    '''
+    rate = bps * (0.8 + 0.2 * (seed % 100) / 100)
+    intervals = []
+    for second in range(duration):
+        interval_bps = rate * (0.6 if second == 0 else 1 + 0.02 * ((seed + second) % 5 - 2))
+        intervals.append({'sum': {
+            'start': float(second), 'end': float(second + 1), 'seconds': 1.0,
+            'bytes': int(interval_bps / 8), 'bits_per_second': interval_bps,
+            'retransmits': (seed + second) % 3,
+        }})
+    sent = sum(interval['sum']['bytes'] for interval in intervals)
+    return {
+        'start': {'connected': [{'socket': 4}], 'test_start': {'duration': duration}},
+        'intervals': intervals,
+        'end': {
+            'streams': [{'sender': {'mean_rtt': 12000 + seed % 5000}}],
+            'sum_sent': {'start': 0, 'end': float(duration), 'seconds': float(duration),
+                         'bytes': sent, 'bits_per_second': sent * 8 / duration,
+                         'retransmits': sum(i['sum']['retransmits'] for i in intervals)},
+            'sum_received': {'start': 0, 'end': float(duration), 'seconds': float(duration),
+                             'bytes': int(sent * 0.99),
+                             'bits_per_second': sent * 8 * 0.99 / duration},
+        },
+    }
+
+
+class FakeServerInterface(paramiko.ServerInterface):
+
+    def __init__(self):
+        self.shell_requested = threading.Event()
+
+    def check_auth_password(self, username, password):
+        return paramiko.AUTH_SUCCESSFUL
+
+    def get_allowed_auths(self, username):
+        return "password"
+
+    def check_channel_request(self, kind, chanid):
+        if kind == "session":
+            return paramiko.OPEN_SUCCEEDED
+        return paramiko.OPEN_FAILED_ADMINISTRATIVELY_PROHIBITED_OPEN_FAILED
+
+    def check_channel_pty_request(self, channel, term, width, height, pixelwidth, pixelheight,
+                                  modes):
+        return True
+
+    def check_channel_shell_request(self, channel):
+        self.shell_requested.set()
+        return True
+
+
+class FortiShell:
+
+    def __init__(self, channel, ip, fake):
+        ''' FortiOS CLI dialogue: echo, prompt and the diagnose traffictest commands.
+        '''
+        self.channel = channel
+        self.prompt = f"BENCH-{ ip.replace('.', '-') } # "
+        self.seed = zlib.crc32(ip.encode())
+        self.fake = fake
+        self.port = 5201
+
+    def send(self, text):
+        self.channel.sendall(text.encode())
+
+    def run(self):
+        self.send(self.prompt)
+        line = ""
+        previous = ""
+        while True:
+            data = self.channel.recv(1024)
+            if not data:
+                break
+            for char in data.decode(errors='ignore'):
+                if char == '\n' and previous == '\r':
+                    previous = char
+                    continue
+                previous = char
+                if char == '\x03':
+                    self.send("^C\r\n" + self.prompt)
+                    line = ""
+                elif char in '\r\n':
+                    self.send("\r\n")
+                    if not self.handle(line.strip()):
+                        self.channel.close()
+                        return
+                    line = ""
+                else:
+                    line += char
+                    self.send(char)
+
+    def handle(self, command):
+        ''' Answer a command, return False once the session is closed.
+        '''
+        if command in ("exit", "quit"):
+            return False
+        if command.startswith("get system status"):
+            self.send(STATUS)
+        elif command.startswith("get system console"):
+            self.send(CONSOLE)
+        elif command.startswith("diagnose traffictest port"):
+            self.port = int(command.split()[-1])
+        elif command.startswith("diagnose traffictest run"):
+            self.send(self.run_test(command))
+        self.send(self.prompt)
+        return True
+
+    def run_test(self, command):
+        with self.fake.lock:
+            self.fake.tests += 1
+        if self.fake.loopback:
+            args = ["iperf3", "-c", self.fake.iperf3_server, "-p", str(self.port), "-J",
+                    "-t", str(max(1, int(self.fake.test_secs)))]
+            parallel = re.search(r" -P (\d+)", command)
+            if parallel:
+                args += ["-P", parallel.group(1)]
+            if " -R" in command:
+                args.append("-R")
+            output = subprocess.run(args, capture_output=True, text=True).stdout
+        else:
+            time.sleep(self.fake.test_secs)
+            output = json.dumps(make_iperf3_json(self.seed), indent=4)
+        return output.replace("\n", "\r\n") + "\r\n"
+
+
+class FakeFortigates:
+
+    def __init__(self, ips, port, test_secs=0.0, loopback=False, iperf3_server="127.0.0.1"):
+        ''' SSH servers for many simulated Fortigates, one listening socket per
+        device IP on the same port, all accepted by a single selector thread.
+            Input: test_secs (duration of a canned traffictest run)
+                   loopback (run a real iperf3 client against the iperf3 server instead)
+        '''
+        self.ips = ips
+        self.port = port
+        self.test_secs = test_secs
+        self.loopback = loopback
+        self.iperf3_server = iperf3_server
+        self.host_key = paramiko.RSAKey.generate(2048)
+        self.selector = selectors.DefaultSelector()
+        self.lock = threading.Lock()
+        self.connections = 0
+        self.tests = 0
+        self.running = False
+
+    def start(self):
+        with tempfile.NamedTemporaryFile('w', prefix="moduli-", delete=False) as file:
+            file.write(MODULI)
+        paramiko.Transport.load_server_moduli(file.name)
+        os.unlink(file.name)
+        for ip in self.ips:
+            sock = socket.socket(socket.AF_INET, socket.SOCK_STREAM)
+            sock.setsockopt(socket.SOL_SOCKET, socket.SO_REUSEADDR, 1)
+            sock.bind((ip, self.port))
+            sock.listen(16)
+            sock.setblocking(False)
+            self.selector.register(sock, selectors.EVENT_READ, ip)
+        self.running = True
+        threading.Thread(target=self.accept_loop, daemon=True).start()
+        return self
+
+    def accept_loop(self):
+        while self.running:
+            for key, mask in self.selector.select(timeout=0.2):
+                try:
+                    client, address = key.fileobj.accept()
+                except BlockingIOError:
+                    continue
+                client.setblocking(True)
+                threading.Thread(target=self.serve, args=(client, key.data), daemon=True).start()
+
+    def serve(self, client, ip):
+        with self.lock:
+            self.connections += 1
+        transport = paramiko.Transport(client)
+        transport.add_server_key(self.host_key)
+        server = FakeServerInterface()
+        try:
+            transport.start_server(server=server)
+            channel = transport.accept(20)
+            if channel is None or not server.shell_requested.wait(10):
+                return
+            FortiShell(channel, ip, self).run()
+        except (paramiko.SSHException, OSError, EOFError):
+            pass
+        finally:
+            transport.close()
+
+    def stop(self):
+        self.running = False
+        for key in list(self.selector.get_map().values()):
+            self.selector.unregister(key.fileobj)
+            key.fileobj.close()
@@ -0,0 +1,91 @@
+import json
+import threading
+from http.server import ThreadingHTTPServer, BaseHTTPRequestHandler
+from urllib.parse import urlparse, parse_qs
+
+
+def make_fixtures(devices_count, sites_count=None, speed_mbps=100):
+    ''' Devices and sites as returned by the Netbox API.
+    Device primary IPs are spread over 127.20.0.0/16, all of it is loopback on Linux.
+        Output: devices (list), sites (list)
+    '''
+    sites_count = sites_count or max(1, devices_count // 2)
+    sites = [{
+        'id': site_id,
+        'name': f"BENCH-SITE-{ site_id:04d}",
+        'slug': f"bench-site-{ site_id:04d}",
+        'custom_fields': {'cf_speed': speed_mbps},
+    } for site_id in range(1, sites_count + 1)]
+    devices = [{
+        'id': i + 1,
+        'name': f"BENCH-FW-{ i + 1:04d}",
+        'primary_ip4': {'address': f"{ device_ip(i) }/32"},
+        'primary_ip': {'address': f"{ device_ip(i) }/32"},
+        'site': {'id': sites[i % sites_count]['id'], 'name': sites[i % sites_count]['name']},
+        'device_type': {'slug': "fortigate-60f"},
+        'status': {'value': "active"},
+    } for i in range(devices_count)]
+    return devices, sites
+
+
+def device_ip(index):
+    return f"127.20.{ index // 250 }.{ index % 250 + 1 }"
+
+
+class FakeNetbox:
+
+    def __init__(self, devices, sites):
+        ''' Minimal Netbox REST API on 127.0.0.1 serving dcim/devices and dcim/sites
+        with limit/offset pagination. Every request is counted in self.calls.
+        '''
+        self.endpoints = {'/api/dcim/devices/': devices, '/api/dcim/sites/': sites}
+        self.calls = 0
+        self.lock = threading.Lock()
+        self.server = ThreadingHTTPServer(('127.0.0.1', 0), self.handler())
+        self.port = self.server.server_port
+
+    def handler(self):
+        fake = self
+
+        class Handler(BaseHTTPRequestHandler):
+
+            def log_message(self, *args):
+                pass
+
+            def do_GET(self):
+                with fake.lock:
+                    fake.calls += 1
+                url = urlparse(self.path)
+                query = parse_qs(url.query)
+                if url.path not in fake.endpoints:
+                    self.reply(404, {'detail': "Not found."})
+                    return
+                objects = fake.endpoints[url.path]
+                if 'id' in query:
+                    objects = [obj for obj in objects if str(obj['id']) in query['id']]
+                limit = int(query.get('limit', [50])[0])
+                offset = int(query.get('offset', [0])[0])
+                next_url = None
+                if offset + limit < len(objects):
+                    next_url = (f"http://127.0.0.1:{ fake.port }{ url.path }"
+                                f"?limit={ limit }&offset={ offset + limit }")
+                self.reply(200, {'count': len(objects), 'next': next_url, 'previous': None,
+                                 'results': objects[offset:offset + limit]})
+
+            def reply(self, code, data):
+                body = json.dumps(data).encode()
+                self.send_response(code)
+                self.send_header('Content-Type', "application/json")
+                self.send_header('Content-Length', str(len(body)))
+                self.end_headers()
+                self.wfile.write(body)
+
+        return Handler
+
+    def start(self):
+        threading.Thread(target=self.server.serve_forever, daemon=True).start()
+        return self
+
+    def stop(self):
+        self.server.shutdown()
+        self.server.server_close()
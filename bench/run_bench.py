@@ -0,0 +1,162 @@
+import argparse
+import json
+import logging
+import os
+import socket
+import subprocess
+import sys
+import tempfile
+import time
+from argparse import RawTextHelpFormatter
+import yaml
+from pyaml_env import parse_config
+from fake_netbox import FakeNetbox, make_fixtures
+from fake_fortigate import FakeFortigates
+
+REPO = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+
+
+def free_ports(count):
+    ''' Return `count` distinct TCP ports free on 127.0.0.1.
+    '''
+    sockets = []
+    for _ in range(count):
+        sock = socket.socket(socket.AF_INET, socket.SOCK_STREAM)
+        sock.bind(('127.0.0.1', 0))
+        sockets.append(sock)
+    ports = [sock.getsockname()[1] for sock in sockets]
+    for sock in sockets:
+        sock.close()
+    return ports
+
+def write_input_vars(workdir, netbox_port, ssh_port, concurrency, nodes=()):
+    ''' Vars/input.yaml for the benchmark, based on Vars/input.yaml.orig
+    so every setting main.py expects is present. Every node gets its own iperf3 ports.
+    '''
+    config = parse_config(os.path.join(REPO, "Vars", "input.yaml.orig"))
+    iperf3_ports = free_ports(concurrency)
+    config['iperf3_server'].update({'ipv4': "127.0.0.1", 'port': iperf3_ports[0],
+                                    'port_pool': iperf3_ports})
+    config['fortigate'].update({'username': "bench", 'password': "bench", 'port': ssh_port})
+    config['netbox'].update({'ipv4': "127.0.0.1", 'port': netbox_port, 'use_ssl': False,
+                             'token_ro': "bench"})
+    config['preflight'].update({'port': ssh_port, 'icmp': False})
+    config['scheduler']['concurrency'] = concurrency
+    config['sharding'].update({'node': "", 'strategy': "hash",
+                               'nodes': [{'name': node} for node in nodes]})
+    os.makedirs(os.path.join(workdir, "Vars"))
+    with open(os.path.join(workdir, "Vars", "input.yaml"), 'w') as file:
+        yaml.safe_dump(config, file)
+    return config
+
+def run_main(workdirs, nodes=()):
+    ''' Run main.py in every workdir at the same time, with -s <node> if nodes are given.
+        Output: wall time (secs), peak RSS of a main.py and its children (MB), worst exit code
+    '''
+    time_start = time.time()
+    processes = [subprocess.Popen([sys.executable, os.path.join(REPO, "main.py"),
+                                   "-c", "clients.txt", "-o", "output.json"]
+                                  + (["-s", nodes[i]] if nodes else []),
+                                  cwd=workdir, stdout=subprocess.DEVNULL, stderr=subprocess.DEVNULL)
+                 for i, workdir in enumerate(workdirs)]
+    peak_rss, exit_code = 0, 0
+    for process in processes:
+        _, status, rusage = os.wait4(process.pid, 0)
+        process.returncode = os.waitstatus_to_exitcode(status)
+        peak_rss = max(peak_rss, rusage.ru_maxrss / 1024)
+        exit_code = max(exit_code, abs(process.returncode))
+    return time.time() - time_start, peak_rss, exit_code
+
+def merge_nodes(workdir, nodes):
+    ''' Merge the outputs of the nodes to workdir/output.json with shards.py.
+    '''
+    process = subprocess.run([sys.executable, os.path.join(REPO, "shards.py"), "merge",
+                              "-o", "output.json"]
+                             + [os.path.join(node, "output.json") for node in nodes],
+                             cwd=workdir, stdout=subprocess.DEVNULL, stderr=subprocess.DEVNULL)
+    return process.returncode
+
+def bench(devices_count, args):
+    devices, sites = make_fixtures(devices_count)
+    netbox = FakeNetbox(devices, sites).start()
+    ssh_port = free_ports(1)[0]
+    ips = [device['primary_ip4']['address'].split('/')[0] for device in devices]
+    fortigates = FakeFortigates(ips, ssh_port, args.test_secs, args.loopback).start()
+    try:
+        with tempfile.TemporaryDirectory(prefix="fortigate-iperf3-bench-") as workdir:
+            # Sharded: one main.py per node, each in its own workdir with its own iperf3 servers
+            nodes = [f"node-{ i }" for i in range(args.shards)] if args.shards > 1 else []
+            config = write_input_vars(workdir, netbox.port, ssh_port, args.concurrency, nodes)
+            for node in nodes:
+                write_input_vars(os.path.join(workdir, node), netbox.port, ssh_port,
+                                 args.concurrency, nodes)
+            wall, peak_rss, exit_code = run_main([os.path.join(workdir, node) for node in nodes]
+                                                 or [workdir], nodes)
+            if nodes:
+                exit_code = max(exit_code, merge_nodes(workdir, nodes))
+            output = {}
+            if os.path.exists(os.path.join(workdir, "output.json")):
+                with open(os.path.join(workdir, "output.json")) as file:
+                    output = json.load(file)
+    finally:
+        fortigates.stop()
+        netbox.stop()
+    passes = 2 if config['iperf3_client']['reverse'] else 1
+    tested = sum(1 for result in output.values() if result.get('upload') not in (None, "0"))
+    return {
+        'devices': devices_count,
+        'concurrency': args.concurrency,
+        'shards': max(args.shards, 1),
+        'exit_code': exit_code,
+        'tested_ok': tested,
+        'wall_secs': round(wall, 2),
+        # wall time one device occupies a scheduler slot for, minus the simulated test itself
+        'per_device_overhead_secs': round(wall * args.concurrency * max(args.shards, 1) / devices_count
+                                          - args.test_secs * passes, 3),
+        'peak_rss_mb': round(peak_rss, 1),
+        'netbox_calls': netbox.calls,
+        'ssh_connections': fortigates.connections,
+        'traffictests': fortigates.tests,
+    }
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description=
+    '''
+    Offline benchmark of the full main.py flow.
+    Runs against a fake Netbox API, fake Fortigate SSH servers on 127.20.0.0/16
+    and the real iperf3 servers of main.py bound to 127.0.0.1.
+    ''',
+    epilog="Thanks for using fortigate-iperf3 tool.",
+    formatter_class=RawTextHelpFormatter
+    )
+    parser.add_argument('-n', '--devices', type=int, nargs='+', default=[10, 100, 1000],
+                        help='Fleet sizes to benchmark. Default 10 100 1000.')
+    parser.add_argument('-p', '--concurrency', type=int, default=8,
+                        help='scheduler.concurrency and size of the iperf3 port pool. Default 8.')
+    parser.add_argument('-t', '--test-secs', type=float, default=0.0,
+                        help='Duration of a simulated traffictest run. Default 0.')
+    parser.add_argument('-l', '--loopback', action='store_true',
+                        help='Run a real iperf3 client against the iperf3 servers instead of\n'
+                             'returning canned JSON (needs the iperf3 binary).')
+    parser.add_argument('-s', '--shards', type=int, default=1,
+                        help='Split the fleet across this many local nodes (main.py -s node-N),\n'
+                             'merged with shards.py. Default 1.')
+    parser.add_argument('-o', '--output', help='Also write the results as JSON to this file.')
+    parser.add_argument('--max-overhead', type=float,
+                        help='Exit with 1 when per-device overhead exceeds this many secs.')
+    args = parser.parse_args()
+    # pre-flight probes close connections before the SSH handshake, do not log them
+    logging.getLogger("paramiko").setLevel(logging.CRITICAL)
+
+    results = []
+    for devices_count in args.devices:
+        result = bench(devices_count, args)
+        results.append(result)
+        print(json.dumps(result))
+    if args.output:
+        with open(args.output, 'w') as file:
+            json.dump(results, file, indent=4)
+    if args.max_overhead is not None and any(
+            result['per_device_overhead_secs'] > args.max_overhead or result['exit_code'] != 0
+            for result in results):
+        sys.exit(1)
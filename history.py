@@ -0,0 +1,65 @@
+import argparse
+import datetime
+import json
+import sys
+from argparse import RawTextHelpFormatter
+from Libs.Functions import Vars
+from Libs.History import HistoryStore
+
+
+def since_timestamp(days):
+    if days is None:
+        return 0
+    return (datetime.datetime.now() - datetime.timedelta(days=days)).timestamp()
+
+def format_ts(ts):
+    return datetime.datetime.fromtimestamp(ts).strftime('%Y-%m-%dT%H:%M:%S')
+
+def print_trend(history, args):
+    for ts, value, rolling in history.rolling_median(args.site, args.window,
+                                                     since_timestamp(args.days), args.field):
+        print(f"{ format_ts(ts) }  { value }  rolling_median={ rolling }")
+
+def print_percentiles(history, args):
+    print(json.dumps(history.percentiles(since_timestamp(args.days), args.site, args.field),
+                     indent=4))
+
+def print_offenders(history, args):
+    print(json.dumps(history.worst_offenders(since_timestamp(args.days), args.limit, args.field),
+                     indent=4))
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description=
+    '''
+    Queries the history of speed-test results stored by main.py.
+    Values in bits_per_second, database path is `paths.history_db` in `Vars/input.yaml`.
+    ''',
+    epilog="Thanks for using fortigate-iperf3 tool.",
+    formatter_class=RawTextHelpFormatter
+    )
+    parser.add_argument('-d', '--days', type=int, help='Only tests of the last DAYS days.')
+    parser.add_argument('-f', '--field', default='download', choices=HistoryStore.FIELDS,
+                        help='Measured value to query. Default download.')
+    subparsers = parser.add_subparsers(dest='command', required=True)
+    trendParser = subparsers.add_parser('trend', help='Tests of a site with rolling median.')
+    trendParser.add_argument('site', help='Netbox site name.')
+    trendParser.add_argument('-w', '--window', type=int, default=3,
+                             help='Rolling median window in tests. Default 3.')
+    trendParser.set_defaults(handler=print_trend)
+    percentilesParser = subparsers.add_parser('percentiles', help='p5/median/p95 per site.')
+    percentilesParser.add_argument('site', nargs='?', help='Netbox site name. Default all sites.')
+    percentilesParser.set_defaults(handler=print_percentiles)
+    offendersParser = subparsers.add_parser('offenders',
+                                            help='Sites with the lowest median against contract.')
+    offendersParser.add_argument('-l', '--limit', type=int, default=10,
+                                 help='Number of sites to show. Default 10.')
+    offendersParser.set_defaults(handler=print_offenders)
+    args = parser.parse_args()
+
+    inputVars = Vars().inputVars
+    history = HistoryStore(inputVars.paths.history_db)
+    try:
+        args.handler(history, args)
+    finally:
+        history.close()
+    sys.exit(0)
@@ -1,6 +1,6 @@
 import json
-from netmiko import ConnectHandler, NetmikoTimeoutException
-import iperf3
+import os
+import signal
 from multiprocessing import Process
 import time
 import datetime
@@ -8,15 +8,64 @@ import argparse
 from argparse import RawTextHelpFormatter
 from Libs.Functions import Paths
 from Libs.Functions import Logger
-from Libs.Functions import NetboxAPI
+from Libs.Functions import NetboxInventory
 from Libs.Functions import Vars
 from Libs.Functions import Convert
-from Libs.Functions import Utils
+from Libs.Scheduler import PortPool
+from Libs.Scheduler import TestScheduler
+from Libs.Scheduler import BandwidthBudget
+from Libs.IperfServer import IperfServerManager
+from Libs.FortiSession import FortiSession
+from Libs.Results import ResultStore
+from Libs.History import HistoryStore
+from Libs.Analytics import get_interval_series
+from Libs.Analytics import fleet_interval_statistics
+from Libs.Preflight import run_preflight
+from Libs.Priority import prioritize
+from Libs.Tracing import Tracer
+from Libs.Tracing import last_device_secs
+from Libs.Service import TestThread
+from Libs.Sharding import get_shard_devices
+from Libs.Retry import RetryPolicy
+from Libs.Retry import backoff_delay
 import re
 import sys
+import statistics
 from pprint import pprint
 
-def get_forti_commands(inputVars, fg_ip, fg_type_slug):
+def get_test_profile(inputVars, fg_type_slug):
+    ''' Return test settings for a Fortigate model.
+    Defaults come from `iperf3_client`, the first of `iperf3_client.profiles`
+    whose `match` substrings are found in the model slug overrides them.
+    '''
+    profile = {
+        'protocol': inputVars.iperf3_client.protocol,
+        'parallel': inputVars.iperf3_client.parallel,
+        'reverse': inputVars.iperf3_client.reverse,
+        'bandwidth': inputVars.iperf3_client.bandwidth,
+    }
+    for model_profile in inputVars.iperf3_client.profiles or []:
+        if not isinstance(model_profile, dict):
+            model_profile = vars(model_profile)
+        if any(substring in fg_type_slug for substring in model_profile['match']):
+            profile.update({key: value for key, value in model_profile.items() if key != 'match'})
+            break
+    return profile
+
+def get_run_command(inputVars, fg_ip, profile, reverse=False):
+    command = f"diagnose traffictest run -c { inputVars.iperf3_server.ipv4 } -B {fg_ip}"
+    if profile['parallel'] > 1:
+        command += f" -P { profile['parallel'] }"
+    if profile['protocol'] == "udp" and profile['bandwidth']:
+        command += f" -b { profile['bandwidth'] }"
+    if reverse:
+        command += " -R"
+    # adaptive TCP runs are watched interval by interval, -J would print only at the end
+    if inputVars.adaptive.enabled and profile['protocol'] == "tcp":
+        return command + f" -t { inputVars.adaptive.max_duration }"
+    return command + " -J"
+
+def get_test_interface(fg_ip, fg_type_slug):
     intf = "WAN"
     if any(substring in fg_type_slug for substring in ['-60f']):
         intf = "wan1"
@@ -24,12 +73,22 @@ def get_forti_commands(inputVars, fg_ip, fg_type_slug):
         intf = "wan"
     if any(substring in fg_ip for substring in ['10.52.22.']):   # if loopback range (new approach with 172.22.52.0/32 for wan)
         intf = "Loopback0"
-    return([
+    return intf
+
+def get_forti_commands(inputVars, fg_ip, fg_type_slug, port=None):
+    intf = get_test_interface(fg_ip, fg_type_slug)
+    profile = get_test_profile(inputVars, fg_type_slug)
+    commands = [
         f"diagnose traffictest client-intf {intf}",
         f"diagnose traffictest server-intf {intf}",
-        f"diagnose traffictest port { inputVars.iperf3_server.port }",
-        f"diagnose traffictest run -c { inputVars.iperf3_server.ipv4 } -B {fg_ip} -J"
-    ])
+        f"diagnose traffictest port { port or inputVars.iperf3_server.port }",
+        # traffictest settings persist on the Fortigate, always set the protocol
+        f"diagnose traffictest proto { 1 if profile['protocol'] == 'udp' else 0 }",
+        get_run_command(inputVars, fg_ip, profile),
+    ]
+    if profile['reverse']:
+        commands.append(get_run_command(inputVars, fg_ip, profile, reverse=True))
+    return commands
 
 def get_clients_list(clients_list_file):
     ''' Read the input file with IP addresses of devices
@@ -64,94 +123,199 @@ def print_app_info(clients_lst, commands_lst, paths, output_file):
     logger.debug("=======================================================================================================================")
     return 0
 
-def run_iperf3_server(inputVars, fortigate_ip):
-    logger = Logger().get_logger()
-    logger.debug(f"::Running test on Fortigate IP { fortigate_ip }\n "+
-          " ... Iperf3 Server has been started.")
-    server = iperf3.Server()
-    server.bind_address = f'{inputVars.iperf3_server.ipv4}'
-    server.port = f'{inputVars.iperf3_server.port}'
-    server.verbose = True
-    result = server.run()
-
-def run_iperf3_client(inputVars, fortigate_ip, commands_lst, path, time_start):
+def run_iperf3_client(inputVars, fortigate_ip, commands_lst, path, time_start, session_pool=None):
+    ''' Run the traffictest commands on a Fortigate and write their output to path.
+    With a session_pool (service mode) a warm session is reused and kept afterwards.
+    '''
+    from netmiko import NetmikoTimeoutException
+    Logger.bind(device=fortigate_ip)
     logger = Logger().get_logger()
-    fortigate = {
-        'device_type': 'fortinet', 
-        'ip': fortigate_ip, 
-        'username': inputVars.fortigate.username, 
-        'password': inputVars.fortigate.password, 
-        'secret': inputVars.fortigate.password, 
-        'verbose': False,
-        'ssh_config_file': '~/.ssh/config'
-    }
+    if session_pool is not None:
+        device_session = session_pool.acquire(fortigate_ip)
+    else:
+        device_session = FortiSession(inputVars, fortigate_ip)
+        # Stop on SIGTERM of the scheduler like on a read timeout: the process exits on its
+        # own and flushes the log queue it shares with all tests, only setting a flag here
+        # keeps the handler clear of any lock
+        signal.signal(signal.SIGTERM, lambda signum, frame: device_session.abort())
+    released = False
+    counters = {}
+    error = None
+    connect_retry = RetryPolicy(inputVars.retry.connect_attempts, inputVars.retry.base_delay,
+                                inputVars.retry.max_delay, transient=FortiSession.is_transient,
+                                on_retry=lambda attempt, e, delay: logger.error(
+                                    f"SSH connect to { fortigate_ip } failed ({ e }), "
+                                    f"attempt { attempt }, next in { round(delay, 1) } secs."),
+                                stop=device_session.aborted)
+    setup_lst = [x for x in commands_lst if not x.startswith("diagnose traffictest run")]
+    run_lst = [x for x in commands_lst if x.startswith("diagnose traffictest run")]
     try:
         logger.debug(f"  ... Iperf3 Client has been started.")
-        device_session = ConnectHandler(**fortigate)
-        device_session.ansi_escape_codes = False
-        device_session.enable()
-        for x in commands_lst:
-            # use for show commands, produces no output when delay factor less than 3
-            output = device_session.send_command(x, delay_factor=2,
-                                                read_timeout=60)
+        if device_session.session is None:
+            connect_retry.call(device_session.connect)
+        # traffictest setup commands return instantly, send them in one go
+        device_session.send_setup(setup_lst)
+        for x in run_lst:
+            suffix = ".reverse" if " -R " in x else ""
+            phase = "test"+suffix.replace(".", "_")
+            if not x.endswith(" -J"):
+                output = json.dumps(device_session.run_adaptive_test(x, inputVars.adaptive, phase))
+            else:
+                output = device_session.run_test(x, phase)
             try:
-                filepath = path+"/"+fortigate_ip
-                if 'diagnose traffictest run -c' in x:
-                    with open(filepath,"w") as the_file:
-                        the_file.write(output)
-                        the_file.write("\r\n")
-                        the_file.close()
+                filepath = path+"/"+fortigate_ip+suffix
+                with open(filepath,"w") as the_file:
+                    the_file.write(output)
+                    the_file.write("\r\n")
             except:
                 logger.debug(f"Cannot write file { filepath }.")
-        device_session.disconnect()
-        logger.debug(f"  ... Iperf3 Client run completed in { round(time.time() - time_start, 2) } secs - OK.")
-    except NetmikoTimeoutException:
+        if session_pool is not None:
+            session_pool.release(fortigate_ip, device_session)
+            released = True
+        else:
+            device_session.disconnect()
+        logger.debug(f"  ... Iperf3 Client run completed in { round(time.time() - time_start, 2) } secs - OK. "
+                     f"Timings: { device_session.timings }")
+    except NetmikoTimeoutException as e:
+        counters['timeouts'] = {'connect': 1}
+        error = e
         logger.error(f"Connection error to { fortigate_ip }. Device is not reachable.")
+    except TimeoutError as e:
+        counters['timeouts'] = {'session': 1}
+        error = e
+        logger.error(f"Timeout on { fortigate_ip }: { e }")
     except Exception as instance:
+        error = instance
         logger.error(f"Exception type: { type(instance) }")
         logger.error(f"Connection error to { fortigate_ip }. Forgot to export USER and PASSWORD?")
+    finally:
+        if session_pool is not None and not released:
+            session_pool.discard(fortigate_ip, device_session)
+        if connect_retry.retries:
+            counters['retries'] = {'ssh_connect': connect_retry.retries}
+        # transient errors put the device on the deferred retry queue of run_fleet
+        if error is not None:
+            error = {'type': type(error).__name__, 'message': str(error),
+                     'transient': FortiSession.is_transient(error)}
+        try:
+            with open(path+"/"+fortigate_ip+".timings", "w") as the_file:
+                the_file.write(json.dumps(device_session.timings))
+            with open(path+"/"+fortigate_ip+".trace", "w") as the_file:
+                the_file.write(json.dumps({'spans': device_session.spans, 'counters': counters,
+                                           'error': error}))
+        except OSError:
+            logger.debug(f"Cannot write timings of { fortigate_ip }.")
 
-def get_circuit_speed_from_netbox(device_json, netbox):
+def get_circuit_speed_from_netbox(device_json, inventory):
     logger = Logger().get_logger()
     try:
-        siteId = device_json[0]['site']['id']
-    except:
+        siteId = device_json['site']['id']
+    except (KeyError, TypeError):
         logger.error(f"    Q: Does the device exist in Netbox?")
-    ckt_speed = netbox.get_circuit_speed_from_sites_menu(siteId)
+        return 0
+    ckt_speed = inventory.get_circuit_speed(siteId)
     ckt_speed_conv = Convert(ckt_speed)
     return ckt_speed_conv.bps
 
-def parse_output_to_final_file(clients_lst, path, netbox_obj):
+def get_test_demand(inputVars, device_json, inventory):
+    ''' Bandwidth (bps) a test of the device takes on the iperf3 server uplink,
+    the contractual speed of its site or scheduler.unknown_speed_mbps if it is not known.
+    '''
+    site = inventory.get_site(device_json['site']['id']) if device_json else None
+    speed = site['custom_fields'].get('cf_speed') if site else None
+    return Convert(speed or inputVars.scheduler.unknown_speed_mbps).bps
+
+def get_interval_stats(jsonData):
+    ''' Summary of per-interval throughput of an iperf3 -J output.
+    '''
+    bps = [interval['sum']['bits_per_second'] for interval in jsonData.get('intervals', [])]
+    if not bps:
+        return {'count': 0}
+    return {
+        'count': len(bps),
+        'min': int(min(bps)),
+        'max': int(max(bps)),
+        'mean': int(statistics.mean(bps)),
+        'stdev': int(statistics.pstdev(bps)),
+    }
+
+def get_end_sums(jsonData):
+    ''' Return (sent, received) summaries of an iperf3 -J output.
+    UDP runs of older iperf3 versions report a single 'sum' only.
+    '''
+    end = jsonData['end']
+    if 'sum_sent' in end:
+        return end['sum_sent'], end['sum_received']
+    return end['sum'], end['sum']
+
+def get_udp_stats(summary):
+    if 'jitter_ms' not in summary:
+        return None
+    return {'jitter_ms': summary['jitter_ms'], 'lost_percent': summary.get('lost_percent')}
+
+def parse_device_output(ip_orig, path, inventory):
+    ''' Parse raw output of a single device.
+        Output: hostname, result dictionary, True if the test result is valid,
+                per-interval series (dictionary or None)
+    '''
     logger = Logger().get_logger()
-    # netbox_obj = NetboxAPI(inputVars)
-    final_dct = {}
-    for ip_orig in clients_lst:
-        ip = ip_orig.split('/')[0]
-        dict_tmp0 = {}
-        # logger.debug(path)
-        hostName = netbox_obj.get_devices_dict_by_params(primary_ip4=ip_orig)[0]['name']
-        device_json  = netbox_obj.get_devices_dict(hostName)
-        dict_tmp0['upload_contractual']   = get_circuit_speed_from_netbox(device_json, netbox_obj)
-        dict_tmp0['download_contractual'] = get_circuit_speed_from_netbox(device_json, netbox_obj)
-        try:
-            with open(path+"/"+ip, 'r') as file:
-                fileData = file.read()
-                jsonData = json.loads(fileData)
-            dict_tmp0['upload'] = int(jsonData['end']['sum_sent']['bits_per_second'])
-            dict_tmp0['download'] = int(jsonData['end']['sum_received']['bits_per_second'])
-        except KeyError:
-            logger.debug(f"ERROR: { ip }: Check Your firewall settings and IP addresses.")
-        except: # json data not found in ip file
-            utils = Utils()
-            logger.debug("WARN: JSON file from device output loading problem. "
-                  "Checking device online status...")
-            if not utils.check_ip_online(ip):
-                logger.debug(f"WARN: { hostName } ({ ip }) is offline.")
-            dict_tmp0['upload']   = "0"
-            dict_tmp0['download'] = "0"
-        finally:
-            final_dct[hostName] = dict_tmp0
-    return final_dct
+    ip = ip_orig.split('/')[0]
+    dict_tmp0 = {}
+    valid = False
+    series = None
+    # logger.debug(path)
+    device_json = inventory.get_device_by_ip(ip_orig)
+    hostName = device_json['name'] if device_json else ip
+    ckt_speed = get_circuit_speed_from_netbox(device_json, inventory)
+    dict_tmp0['upload_contractual']   = ckt_speed
+    dict_tmp0['download_contractual'] = ckt_speed
+    if os.path.exists(path+"/"+ip+".timings"):
+        with open(path+"/"+ip+".timings", 'r') as file:
+            dict_tmp0['timings'] = json.loads(file.read())
+    try:
+        with open(path+"/"+ip, 'r') as file:
+            fileData = file.read()
+            jsonData = json.loads(fileData)
+        sum_sent, sum_received = get_end_sums(jsonData)
+        # with a reverse (-R) pass, download is what the Fortigate received in that pass,
+        # a failed reverse pass leaves the upload of the forward pass valid
+        if os.path.exists(path+"/"+ip+".reverse"):
+            try:
+                with open(path+"/"+ip+".reverse", 'r') as file:
+                    sum_received = get_end_sums(json.loads(file.read()))[1]
+            except (OSError, ValueError, KeyError) as e:
+                logger.debug(f"WARN: { hostName } ({ ip }): no JSON result of the reverse pass.")
+                dict_tmp0['reverse_error'] = f"{ type(e).__name__ }: { e }"
+                sum_received = None
+        dict_tmp0['upload'] = int(sum_sent['bits_per_second'])
+        dict_tmp0['download'] = int(sum_received['bits_per_second']) if sum_received else None
+        dict_tmp0['retransmits'] = sum_sent.get('retransmits')
+        if get_udp_stats(sum_sent) is not None:
+            dict_tmp0['udp'] = {'upload': get_udp_stats(sum_sent),
+                                'download': get_udp_stats(sum_received) if sum_received else None}
+        dict_tmp0['intervals'] = get_interval_stats(jsonData)
+        streams = jsonData['end'].get('streams') or [{}]
+        dict_tmp0['mean_rtt_us'] = streams[0].get('sender', {}).get('mean_rtt')
+        if 'adaptive' in jsonData:
+            dict_tmp0['adaptive'] = jsonData['adaptive']
+        series = get_interval_series(jsonData)
+        # an adaptive test cut off by its timeout has truncated throughput
+        valid = not jsonData.get('adaptive', {}).get('partial')
+    except KeyError:
+        logger.debug(f"ERROR: { ip }: Check Your firewall settings and IP addresses.")
+    except (OSError, ValueError, TypeError): # json data not found in ip file, reachability was checked by the pre-flight sweep
+        logger.debug(f"WARN: { hostName } ({ ip }): JSON file from device output loading problem.")
+        dict_tmp0['upload']   = "0"
+        dict_tmp0['download'] = "0"
+    return hostName, dict_tmp0, valid, series
+
+def remove_device_output(ip, path):
+    ''' Remove raw output of a previous run of the device.
+    '''
+    for filepath in [path+"/"+ip, path+"/"+ip+".reverse", path+"/"+ip+".timings",
+                     path+"/"+ip+".trace"]:
+        if os.path.exists(filepath):
+            os.remove(filepath)
 
 def write_to_final_file(input, output_file):
     with open(output_file, 'w') as file:
@@ -161,38 +325,307 @@ def write_to_final_file(input, output_file):
 def get_input_vars():
     return Vars()
 
-def update_client_list_from_netbox(netbox_obj, client_list_file):
-    ''' Return a list of json firewall data from netbox
-    based on filter and write their IPs to input file.
+# status: Active, role: Firewall, manufacturer: Fortinet, tenant: not SWAN,
+# regions are taken from inventory.regions by get_netbox_filters()
+NETBOX_FW_FILTERS = {
+    'status': "active",
+    # 'status': "planned",
+    # FOR TESTING PURPOSES, WORK WITH SINGLE HOSTNAME ONLY
+    # 'name': "SVK-ECOPEZIN-FW",
+    'role_id': 4,
+    'manufacturer_id': 2,
+    'tenant_id__n': 6,
+}
+
+def get_netbox_filters(inputVars):
+    ''' Device filters of the inventory, NETBOX_FW_FILTERS limited to inventory.regions
+    (region_id=1 for Slovakia, region_id=3 for Austria).
+    '''
+    return dict(NETBOX_FW_FILTERS, region_id=inputVars.inventory.regions)
+
+def update_client_list_from_netbox(inventory, client_list_file, devices=None):
+    ''' Return a list of json firewall data from the Netbox inventory
+    (or its shard `devices`) and write their IPs to input file.
     '''
-    # region_id=1 for Slovakia, region_id=3 for Austria, status: Active, role: Firewall, manufacturer: Fortinet, tenant: not SWAN
-    fw_list = netbox_obj.get_devices_dict_by_params(
-        region_id=1,
-        status="active",
-        # status="planned",
-        # FOR TESTING PURPOSES, WORK WITH SINGLE HOSTNAME ONLY
-        # name="SVK-ECOPEZIN-FW",
-        role_id=4,
-        manufacturer_id=2,
-        tenant_id__n=6
-        )
+    fw_list = inventory.devices if devices is None else devices
     with open(client_list_file, 'w') as file:
         for i in fw_list:
             ip = i['primary_ip4']['address']
             file.write(f"{ip}\n")
     return(fw_list)
 
+def build_final_output(results, clients_lst=None):
+    ''' Final JSON is built from the streamed per-device records,
+    interval analytics of the whole fleet are computed in one batched pass.
+    '''
+    final_output = results.to_final_dict(clients_lst)
+    for hostName, analytics in fleet_interval_statistics(results.series_by_host(clients_lst)).items():
+        final_output[hostName]['analytics'] = analytics
+    return final_output
+
+def run_fleet(inputVars, run_id, clients_lst, output_file, inventory, history, server_manager,
+              ready_ports, tracer, path_files, resume=False, incremental=False, session_pool=None,
+              results=None, output_clients=None):
+    ''' Test all clients and write the final output JSON.
+    Tests of a one-shot run are separate processes. The service passes a session_pool,
+    its tests run in threads on warm Fortigate sessions.
+        Input: results (ResultStore kept across runs, e.g. by the service, all clients are
+                        tested again, default a store of output_file+".jsonl" for this run)
+               output_clients (clients of the final output, default clients_lst)
+        Output: final output (dictionary), number of devices by state (dictionary)
+    '''
+    logger = Logger().get_logger()
+    pending_lst = list(clients_lst)
+    if results is None:
+        results = ResultStore(output_file+".jsonl", resume=resume)
+        pending_lst = results.pending(clients_lst)
+    if len(pending_lst) < len(clients_lst):
+        logger.debug(f"=== RESUMING: { len(clients_lst) - len(pending_lst) } DEVICES ALREADY HAVE A VALID RESULT.")
+    launched = {}
+    # Devices which failed on a transient error are tested again after the main pass,
+    # their failed attempt goes to the history only if no retry follows
+    deferred = []
+    deferred_history = {}
+    hung = set()
+    retry_round = 0
+
+    # Incremental run: devices which need a test most go first, healthy ones last or not at all
+    reasons = {}
+    deadline = None
+    if incremental:
+        pending_lst, reasons = prioritize(pending_lst, history.last_tests(), inputVars.incremental)
+        if inputVars.incremental.time_budget:
+            deadline = tracer.time_start + inputVars.incremental.time_budget
+
+    def record_result(client_ip, reachability=None):
+        ip = client_ip.split('/')[0]
+        with Logger.context(device=ip):
+            error = tracer.load_device_trace(ip, path_files+"/"+ip+".trace").get('error') or {}
+            with tracer.span('parse', ip):
+                hostName, result, valid, series = parse_device_output(client_ip, path_files, inventory)
+            if reachability is not None:
+                result['reachability'] = reachability
+            if client_ip in reasons:
+                result['priority'] = reasons[client_ip]
+            if retry_round:
+                result['attempts'] = retry_round + 1
+            # The failed attempt is recorded too, a later valid record replaces it
+            # in the results, the history gets only the last attempt
+            transient = error.get('transient') or client_ip in hung
+            if not valid and transient and reachability is None \
+                    and retry_round < inputVars.retry.deferred_rounds:
+                logger.debug("  ... Test failed on a transient error, deferred to the retry queue.")
+                deferred.append(client_ip)
+            with tracer.span('write', ip):
+                results.append(client_ip, hostName, result, valid, series)
+                fg = inventory.get_device_by_ip(client_ip)
+                site = inventory.get_site(fg['site']['id']) if fg else None
+                if client_ip in deferred:
+                    deferred_history[client_ip] = (hostName, site, result, valid)
+                else:
+                    deferred_history.pop(client_ip, None)
+                    history.record(run_id, client_ip, hostName, site, result, valid)
+            if client_ip in launched:
+                time_start = launched.pop(client_ip)
+                tracer.add('device', time_start, time.time() - time_start, ip, valid=valid)
+
+    # Sweep all clients before scheduling, unreachable ones are recorded right away
+    unreachable = {}
+    if inputVars.preflight.enabled:
+        pending_lst, unreachable = run_preflight(pending_lst, inputVars.preflight)
+        for client_ip, reachability in unreachable.items():
+            remove_device_output(client_ip.split('/')[0], path_files)
+            record_result(client_ip, reachability)
+
+    # Run iperf3 client on Fortigate for every device, keeping up to
+    # `scheduler.concurrency` tests in flight on distinct server ports
+    def launch_test(client_ip, port):
+        ip = client_ip.split('/')[0]
+        with Logger.context(device=ip, port=port):
+            launched[client_ip] = time.time()
+            fg = inventory.get_device_by_ip(client_ip)
+            fg_type = fg['device_type']['slug'] if fg else ""
+            logger.debug(f"::Running test on Fortigate IP { ip } against Iperf3 Server port { port }.")
+            remove_device_output(ip, path_files)
+            client_args = (inputVars, ip, get_forti_commands(inputVars, ip, fg_type, port),
+                           path_files, time.time())
+            if session_pool is not None:
+                processClient = TestThread(run_iperf3_client, client_args + (session_pool,),
+                                           lambda: session_pool.abort(ip))
+            else:
+                processClient = Process(target=run_iperf3_client, args=client_args)
+            processClient.start()
+            return [processClient]
+
+    def collect_server_results():
+        server_manager.ensure_running()
+        for result in server_manager.get_results():
+            if result['error']:
+                logger.debug(f"  ... Iperf3 Server port { result['port'] }: { result['error'] }")
+            else:
+                logger.debug(f"  ... Iperf3 Server port { result['port'] } finished test "
+                             f"from { result['remote_host'] }.")
+
+    # Tests in flight must fit in the server uplink, otherwise they measure each other
+    budget = None
+    if inputVars.scheduler.uplink_mbps:
+        budget = BandwidthBudget(Convert(inputVars.scheduler.uplink_mbps).bps)
+    scheduler = TestScheduler(PortPool(ready_ports),
+                              inputVars.scheduler.concurrency, inputVars.scheduler.timeout,
+                              budget=budget)
+
+    def on_timeout(client_ip, port):
+        tracer.count('timeouts', 'scheduler')
+        tracer.count('retries', 'iperf3_server')
+        hung.add(client_ip)
+        if not server_manager.restart(port):
+            # every later test on the port would fail
+            logger.error(f"Iperf3 Server on port { port } did not come back, port dropped from the pool.")
+            tracer.count('ports_dropped', 'iperf3_server')
+            scheduler.port_pool.remove(port)
+
+    def run_pass(clients):
+        return scheduler.run(clients, launch_test, poll=collect_server_results,
+                             on_timeout=on_timeout, on_finish=record_result,
+                             demand=lambda client_ip: get_test_demand(
+                                 inputVars, inventory.get_device_by_ip(client_ip), inventory),
+                             ordered=incremental, deadline=deadline)
+
+    timed_out = run_pass(pending_lst)
+    not_started = list(scheduler.not_started)
+    retried = []
+    # Deferred retry queue: a hanging or flapping device does not hold up the main pass,
+    # it is tested again once all other devices are done, after a jittered backoff
+    while deferred and retry_round < inputVars.retry.deferred_rounds and not scheduler.not_started:
+        retry_round += 1
+        retry_lst = list(deferred)
+        deferred.clear()
+        hung.clear()
+        delay = backoff_delay(retry_round, inputVars.retry.base_delay, inputVars.retry.max_delay)
+        logger.debug(f"=== RETRY ROUND { retry_round }: { len(retry_lst) } DEVICES IN { round(delay, 1) } SECS.")
+        tracer.count('retries', 'test', len(retry_lst))
+        retried.extend(retry_lst)
+        time.sleep(delay)
+        timed_out += run_pass(retry_lst)
+    # Deferred devices left without a retry when the time budget ran out
+    for client_ip in deferred:
+        history.record(run_id, client_ip, *deferred_history.pop(client_ip))
+    collect_server_results()
+    if scheduler.not_started:
+        logger.error(f"Time budget used up, { len(scheduler.not_started) } devices were not tested.")
+
+    final_output = build_final_output(results, clients_lst if output_clients is None else output_clients)
+    write_to_final_file(final_output, output_file)
+
+    # Where the run time went: Chrome trace of all spans, Prometheus textfile of the run
+    devices = {
+        'total': len(clients_lst),
+        'tested': len(pending_lst) - len(not_started),
+        'not_started': len(not_started),
+        'valid': sum(1 for client_ip in clients_lst if results.is_done(client_ip)),
+        'unreachable': len(unreachable),
+        'timed_out': len(set(timed_out)),
+        'retried': len(retried),
+    }
+    tracer.write(inputVars.tracing.trace_file, inputVars.tracing.prometheus_file, devices)
+    return final_output, devices
+
+# SSH connect, enable, setup and disconnect of a test, when no previous run was traced
+SESSION_OVERHEAD_SECS = 5
+
+def get_estimated_test_secs(inputVars):
+    ''' Secs a device test takes a scheduler slot: the median of the last traced run,
+    otherwise the test duration (traffictest default 10 secs or adaptive.max_duration)
+    per pass plus the session overhead, at most scheduler.timeout.
+        Output: secs, source of the estimate
+    '''
+    secs = last_device_secs(inputVars.tracing.trace_file) if inputVars.tracing.trace_file else None
+    source = "last run"
+    if secs is None:
+        passes = 2 if inputVars.iperf3_client.reverse else 1
+        duration = inputVars.adaptive.max_duration if inputVars.adaptive.enabled else 10
+        secs = passes * duration + SESSION_OVERHEAD_SECS
+        source = "settings"
+    return min(secs, inputVars.scheduler.timeout), source
+
+def plan_fleet(inputVars, clients_lst, output_file, inventory, resume=False, incremental=False):
+    ''' Execution plan of run_fleet() without touching a device, an iperf3 server
+    or the results: targets in test order with their interface, commands and port,
+    and the estimated run time. Pre-flight probes are not part of the plan.
+        Output: plan (dictionary)
+    '''
+    pending_lst = clients_lst
+    if resume and os.path.exists(output_file+".jsonl"):
+        pending_lst = ResultStore(output_file+".jsonl", resume=True).pending(clients_lst)
+    already_valid = len(clients_lst) - len(pending_lst)
+    reasons = {}
+    time_budget = 0
+    if incremental:
+        last_tests = {}
+        if os.path.exists(inputVars.paths.history_db):
+            history = HistoryStore(inputVars.paths.history_db)
+            last_tests = history.last_tests()
+            history.close()
+        pending_lst, reasons = prioritize(pending_lst, last_tests, inputVars.incremental)
+        time_budget = inputVars.incremental.time_budget
+
+    def demand(client_ip):
+        return get_test_demand(inputVars, inventory.get_device_by_ip(client_ip), inventory)
+
+    test_secs, test_secs_source = get_estimated_test_secs(inputVars)
+    budget = None
+    if inputVars.scheduler.uplink_mbps:
+        budget = BandwidthBudget(Convert(inputVars.scheduler.uplink_mbps).bps)
+    scheduler = TestScheduler(PortPool(inputVars.iperf3_server.port_pool),
+                              inputVars.scheduler.concurrency, inputVars.scheduler.timeout,
+                              budget=budget)
+    assignments, run_secs, not_started = scheduler.simulate(pending_lst, test_secs, demand,
+                                                            ordered=incremental,
+                                                            time_budget=time_budget)
+
+    devices = []
+    for client_ip in sorted(pending_lst, key=lambda client_ip: (client_ip not in assignments,
+                            assignments.get(client_ip, {}).get('start', 0))):
+        ip = client_ip.split('/')[0]
+        fg = inventory.get_device_by_ip(client_ip)
+        fg_type = fg['device_type']['slug'] if fg else ""
+        assignment = assignments.get(client_ip)
+        devices.append({
+            'ip': client_ip,
+            'host': fg['name'] if fg else None,
+            'model': fg_type,
+            'interface': get_test_interface(ip, fg_type),
+            'demand_mbps': demand(client_ip) // 1000000,
+            'priority': reasons.get(client_ip),
+            'port': assignment['port'] if assignment else None,
+            'start_secs': round(assignment['start']) if assignment else None,
+            'commands': get_forti_commands(inputVars, ip, fg_type, assignment['port']) if assignment else [],
+        })
+    return {
+        'inventory': {'devices': len(inventory.devices), 'age_secs': round(inventory.age())},
+        'targets': len(clients_lst),
+        'already_valid': already_valid,
+        'skipped_healthy': len(clients_lst) - already_valid - len(pending_lst),
+        'iperf3_server': inputVars.iperf3_server.ipv4,
+        'concurrency': scheduler.concurrency,
+        'uplink_mbps': inputVars.scheduler.uplink_mbps,
+        'test_secs': round(test_secs, 1),
+        'test_secs_source': test_secs_source,
+        'estimated_run_secs': round(run_secs),
+        'not_started': len(not_started),
+        'devices': devices,
+    }
+
 if __name__ == '__main__':
     '''
     Run iperf3 server on Linuxbox.
     Run iperf3 client on Fortigate and store output to file.
     '''
-    # Rotate old logs
-    Logger().rotate_old_logs(Logger().log_file)
-    # Initiate logger
+    # Initiate logger, app.log is rotated by size
     logger = Logger().get_logger()
     logger.debug(f"### EXECUTION STARTED [{ datetime.datetime.now() }].")
     time_overall_start = time.time()
+    run_id = datetime.datetime.fromtimestamp(time_overall_start).strftime('%Y%m%dT%H%M%S')
 
     # Arguments
     parser = argparse.ArgumentParser(description=
@@ -214,55 +647,81 @@ if __name__ == '__main__':
     optionalParser = parser.add_argument_group('Optional arguments')
     requiredParser.add_argument('-c', '--client-list', help='Provide clients list filename. One IP per line.', required=True)
     requiredParser.add_argument('-o', '--output-file', help='File to store the output JSON.', required=True)
+    optionalParser.add_argument('--resume', action='store_true',
+                                help='Continue an interrupted run, skip devices with a valid result\n'
+                                     'in OUTPUT_FILE.jsonl.')
+    optionalParser.add_argument('-r', '--refresh-inventory', action='store_true',
+                                help='Ignore the cached Netbox inventory and fetch it again.')
+    optionalParser.add_argument('-i', '--incremental', action='store_true',
+                                help='Test untested, failed, sub-contract and stale devices first\n'
+                                     'and stop starting tests once incremental.time_budget is used.')
+    optionalParser.add_argument('-s', '--shard',
+                                help='Test only the devices of this node of sharding.nodes.\n'
+                                     'Default sharding.node, empty tests all devices.')
+    optionalParser.add_argument('--plan', action='store_true',
+                                help='Print the execution plan (targets, interfaces, commands, ports,\n'
+                                     'estimated run time) from the cached inventory and exit.\n'
+                                     'Nothing is tested, only app.log and a missing inventory\n'
+                                     'cache are written.')
     # optionalParser.add_argument('-e', '--env', help='Environmnet variables file. Default .env.')
     args = parser.parse_args()
     # inputVars = BaseConfig(parse_config('Vars/input.yaml'))
     inputVars = get_input_vars().inputVars
+    tracer = Tracer(run_id)
+
+    # A plan takes the cached inventory at any age, Netbox is asked only if there is no cache
+    with tracer.span('netbox_inventory'):
+        inventory = NetboxInventory(inputVars, get_netbox_filters(inputVars)).load(
+            refresh=args.refresh_inventory, stale_ok=args.plan)
+    tracer.count('retries', 'netbox', inventory.retries)
+    # Without an inventory the client list and the outputs of the previous run are left as they are
+    if not inventory.devices:
+        logger.error("No inventory, neither from Netbox nor from its cache. Nothing to test.")
+        sys.exit(1)
+    # Sharded run: this node tests its part of the fleet against its own iperf3 server
+    try:
+        devices = get_shard_devices(inventory, inputVars.sharding, args.shard or inputVars.sharding.node)
+    except ValueError as e:
+        logger.error(str(e))
+        sys.exit(1)
+    if args.plan:
+        clients_lst = [device['primary_ip4']['address'] for device in devices if device.get('primary_ip4')]
+        plan = plan_fleet(inputVars, clients_lst, args.output_file, inventory,
+                          resume=args.resume, incremental=args.incremental)
+        print(json.dumps(dict(plan, shard=args.shard or inputVars.sharding.node or None), indent=4))
+        sys.exit(0)
+
+    # Output directories are set up once the run is validated
     path_all = Paths(inputVars)
     paths = path_all.path_run
-
-    netbox_obj = NetboxAPI(inputVars)
-    fw_list = update_client_list_from_netbox(netbox_obj, args.client_list)
+    fw_list = update_client_list_from_netbox(inventory, args.client_list, devices)
     # pprint(fw_list)
 
     # Print basic application information
     clients_lst = get_clients_list(args.client_list)
     print_app_info(clients_lst, get_forti_commands(inputVars, "<source_ip>",\
-        "<fortigate_model_slug"), path_all, args.output_file)
-
-    # Define main process of iperf3 server on Linuxbox to be run in background
-
-    # Define side process of iperf3 client on Fortigate
-    processes_lst = []
-    for client_ip in clients_lst:
-        # print(client_ip)
-        for fg in fw_list:
-            if client_ip == fg['primary_ip']['address']:
-                fg_type = fg['device_type']['slug']
-                break
-        time_start = time.time()
-        processServer = Process(target=run_iperf3_server,\
-            args=(inputVars, client_ip.split('/')[0]))
-        processes_lst.append(processServer)
-        processServer.start()
-        time.sleep(3)
-        processClient = Process(target=run_iperf3_client, args=(inputVars,\
-            client_ip.split('/')[0], get_forti_commands(inputVars,\
-            client_ip.split('/')[0], fg_type), path_all.path_files, time_start))
-        processes_lst.append(processClient)
-        processClient.start()
-        time.sleep(3)
-        # Terminate the processes couple
-        for proc in processes_lst:
-            proc.join(timeout=240)
-            if proc.is_alive():
-                logger.error(f"Process taking too long. Skipping {client_ip.split('/')[0]}.")
-                proc.terminate()
-                break
-        logger.debug(f"  ... Iperf3 Server has been stopped.")
-
-    # Parse output files for required values
-    final_output = parse_output_to_final_file(clients_lst, path_all.path_files, netbox_obj)
-    write_to_final_file(final_output, args.output_file)
+        "<fortigate_model_slug>", "<leased_port>"), path_all, args.output_file)
+
+    # Run one persistent iperf3 server per port of the pool on Linuxbox
+    server_manager = IperfServerManager(inputVars.iperf3_server.ipv4,
+                                        inputVars.iperf3_server.port_pool,
+                                        inputVars.iperf3_server.ready_timeout)
+    with tracer.span('server_ready'):
+        ready_ports = server_manager.start()
+    if not ready_ports:
+        server_manager.stop()
+        logger.error("No Iperf3 Server is listening. Check iperf3_server settings.")
+        sys.exit(1)
+
+    history = HistoryStore(inputVars.paths.history_db)
+    FortiSession.preload()
+    try:
+        run_fleet(inputVars, run_id, clients_lst, args.output_file, inventory, history,
+                  server_manager, ready_ports, tracer, path_all.path_files,
+                  resume=args.resume, incremental=args.incremental)
+    finally:
+        server_manager.stop()
+        history.close()
+    logger.debug(f"  ... Iperf3 Servers have been stopped.")
 
     logger.debug(f"### EXECUTION COMPLETED IN { round(time.time() - time_overall_start, 2) } SECS.")
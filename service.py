@@ -0,0 +1,141 @@
+import argparse
+import datetime
+import signal
+import sys
+import time
+from argparse import RawTextHelpFormatter
+from Libs.Functions import Paths
+from Libs.Functions import Logger
+from Libs.Functions import NetboxInventory
+from Libs.Functions import Vars
+from Libs.FortiSession import FortiSessionPool
+from Libs.IperfServer import IperfServerManager
+from Libs.History import HistoryStore
+from Libs.Results import ResultStore
+from Libs.Service import Service
+from Libs.Service import start_api
+from Libs.Sharding import get_shard_devices
+from Libs.Tracing import Tracer
+from main import get_netbox_filters
+from main import run_fleet
+
+
+def get_service_clients(devices, request):
+    ''' Primary IPs of the devices (of the inventory or its shard), limited to the
+    'clients' (IPs with or without prefix length) and 'sites' (names) of the request.
+    '''
+    wanted_ips = {ip.split('/')[0] for ip in request.get('clients') or []}
+    wanted_sites = set(request.get('sites') or [])
+    clients = []
+    for device in devices:
+        if not device.get('primary_ip4'):
+            continue
+        address = device['primary_ip4']['address']
+        if wanted_ips and address.split('/')[0] not in wanted_ips:
+            continue
+        if wanted_sites and (device.get('site') or {}).get('name') not in wanted_sites:
+            continue
+        clients.append(address)
+    return clients
+
+if __name__ == '__main__':
+    '''
+    Keep iperf3 servers, the Netbox inventory and Fortigate sessions warm
+    and run tests on schedule or on request.
+    '''
+    logger = Logger().get_logger()
+    logger.debug(f"### SERVICE STARTED [{ datetime.datetime.now() }].")
+
+    parser = argparse.ArgumentParser(description=
+    '''
+    Runs fortigate-iperf3 as a resident service.
+    Tests run every `service.interval` secs and on request through the local API
+    (`service.listen` in `Vars/input.yaml`):
+        curl -s localhost:8201/status
+        curl -s -X POST localhost:8201/run -d '{"sites": ["SITE-NAME"]}'
+        curl -s localhost:8201/results
+    Fortigate Username and Password need to be exported before the service is started.
+    ''',
+    epilog="Thanks for using fortigate-iperf3 tool.",
+    formatter_class=RawTextHelpFormatter
+    )
+    parser.add_argument('-l', '--listen', help='Override service.listen, host:port or unix:/path.')
+    parser.add_argument('-r', '--refresh-inventory', action='store_true',
+                        help='Ignore the cached Netbox inventory and fetch it again on start.')
+    parser.add_argument('-s', '--shard', help='Override sharding.node, test only the devices of this node.')
+    args = parser.parse_args()
+    inputVars = Vars().inputVars
+    path_all = Paths(inputVars)
+    shard = args.shard or inputVars.sharding.node
+    if shard and shard not in [node['name'] for node in inputVars.sharding.nodes]:
+        logger.error(f"Shard { shard } is not one of sharding.nodes.")
+        sys.exit(1)
+
+    warm = {'inventory': NetboxInventory(inputVars, get_netbox_filters(inputVars)).load(refresh=args.refresh_inventory)}
+    if not warm['inventory'].devices:
+        logger.error("No inventory, neither from Netbox nor from its cache.")
+        sys.exit(1)
+    server_manager = IperfServerManager(inputVars.iperf3_server.ipv4,
+                                        inputVars.iperf3_server.port_pool,
+                                        inputVars.iperf3_server.ready_timeout)
+    ready_ports = server_manager.start()
+    if not ready_ports:
+        server_manager.stop()
+        logger.error("No Iperf3 Server is listening. Check iperf3_server settings.")
+        sys.exit(1)
+    history = HistoryStore(inputVars.paths.history_db)
+    # One store for all runs: a run limited to some sites or clients replaces
+    # their records, the output keeps the last result of every other device
+    results = ResultStore(inputVars.service.output_file+".jsonl", resume=True)
+    session_pool = FortiSessionPool(inputVars, inputVars.service.pool_size,
+                                    inputVars.service.pool_idle_timeout)
+
+    def refresh_inventory():
+        ''' Refetch a stale inventory, keep the old one if Netbox is not reachable.
+        '''
+        if warm['inventory'].age() <= inputVars.inventory.ttl:
+            return
+        inventory = NetboxInventory(inputVars, get_netbox_filters(inputVars)).load()
+        if inventory.devices:
+            warm['inventory'] = inventory
+        if warm['inventory'].age() > inputVars.inventory.ttl:
+            # try again after another ttl
+            warm['inventory'].timestamp = time.time()
+            logger.error("Netbox inventory refresh failed, keeping the previous inventory.")
+
+    def run(request):
+        refresh_inventory()
+        run_id = datetime.datetime.now().strftime('%Y%m%dT%H%M%S') + f"-{ request['id'] }"
+        devices = get_shard_devices(warm['inventory'], inputVars.sharding, shard)
+        clients_lst = get_service_clients(devices, request)
+        inventory_clients = get_service_clients(devices, {})
+        # devices which left the inventory are dropped, the file keeps one record per device
+        results.compact(inventory_clients)
+        _, devices = run_fleet(inputVars, run_id, clients_lst, inputVars.service.output_file,
+                               warm['inventory'], history, server_manager, ready_ports,
+                               Tracer(run_id), path_all.path_files,
+                               incremental=request.get('incremental', False),
+                               session_pool=session_pool, results=results,
+                               output_clients=inventory_clients)
+        return {'run_id': run_id, 'devices': devices}
+
+    def housekeeping():
+        session_pool.evict_idle()
+        server_manager.ensure_running()
+        refresh_inventory()
+
+    service = Service(run, inputVars.service.interval, inputVars.service.incremental)
+    api = start_api(args.listen or inputVars.service.listen, service, inputVars.service.output_file,
+                    lambda: {'sessions': session_pool.stats(),
+                             'inventory_age': round(warm['inventory'].age())})
+    signal.signal(signal.SIGTERM, lambda signum, frame: service.stop())
+    try:
+        service.serve_forever(housekeeping)
+    except KeyboardInterrupt:
+        pass
+    finally:
+        api.shutdown()
+        session_pool.close_all()
+        server_manager.stop()
+        history.close()
+    logger.debug(f"### SERVICE STOPPED [{ datetime.datetime.now() }].")
@@ -0,0 +1,61 @@
+import argparse
+import json
+import sys
+from argparse import RawTextHelpFormatter
+from Libs.Functions import Logger
+from Libs.Functions import NetboxInventory
+from Libs.Functions import Vars
+from Libs.Sharding import assign_shards
+from Libs.Sharding import merge_shards
+from main import build_final_output
+from main import get_netbox_filters
+from main import write_to_final_file
+
+
+def print_plan(inputVars, args):
+    inventory = NetboxInventory(inputVars, get_netbox_filters(inputVars)).load(refresh=args.refresh_inventory)
+    if not inputVars.sharding.nodes:
+        print("No sharding.nodes defined.")
+        return 1
+    shards = assign_shards(inventory.devices, inventory, inputVars.sharding)
+    plan = {node: len(devices) for node, devices in shards.items()}
+    if args.verbose:
+        plan = {node: [device['name'] for device in devices] for node, devices in shards.items()}
+    print(json.dumps(plan, indent=4))
+    return 0
+
+def merge_output(inputVars, args):
+    merged, final_hosts = merge_shards(args.files, args.output_file)
+    final_output = dict(final_hosts, **build_final_output(merged))
+    write_to_final_file(final_output, args.output_file)
+    print(f"{ len(final_output) } hosts merged to { args.output_file }.")
+    return 0 if final_output else 1
+
+if __name__ == '__main__':
+    logger = Logger().get_logger()
+    parser = argparse.ArgumentParser(description=
+    '''
+    Sharded runs across several collector nodes, see `sharding` in `Vars/input.yaml`.
+    Every node runs its own shard:
+        python main.py -c client_file -o output_svk.json -s svk
+    The -o files of the nodes are then copied to one place and merged:
+        python shards.py merge -o output_file output_svk.json output_aut.json
+    ''',
+    epilog="Thanks for using fortigate-iperf3 tool.",
+    formatter_class=RawTextHelpFormatter
+    )
+    subparsers = parser.add_subparsers(dest='command', required=True)
+    planParser = subparsers.add_parser('plan', help='Number of devices per node.')
+    planParser.add_argument('-v', '--verbose', action='store_true', help='List device names.')
+    planParser.add_argument('-r', '--refresh-inventory', action='store_true',
+                            help='Ignore the cached Netbox inventory and fetch it again.')
+    planParser.set_defaults(handler=print_plan)
+    mergeParser = subparsers.add_parser('merge', help='Merge the outputs of the nodes.')
+    mergeParser.add_argument('-o', '--output-file', required=True, help='File to store the merged JSON.')
+    mergeParser.add_argument('files', nargs='+',
+                             help='-o files of the nodes, their .jsonl records are used if present.')
+    mergeParser.set_defaults(handler=merge_output)
+    args = parser.parse_args()
+
+    inputVars = Vars().inputVars
+    sys.exit(args.handler(inputVars, args))
@@ -0,0 +1,68 @@
+import unittest
+from Libs.Adaptive import ConvergenceDetector
+from Libs.Adaptive import IperfTextParser
+
+PARALLEL_OUTPUT = '''Connecting to host 10.152.10.48, port 5201
+[  4] local 10.52.22.1 port 40001 connected to 10.152.10.48 port 5201
+[  6] local 10.52.22.1 port 40002 connected to 10.152.10.48 port 5201
+[ ID] Interval           Transfer     Bandwidth       Retr  Cwnd
+[  4]   0.00-1.00   sec  5.00 MBytes  40.0 Mbits/sec    1    212 KBytes
+[  6]   0.00-1.00   sec  6.00 MBytes  50.0 Mbits/sec    2    212 KBytes
+[SUM]   0.00-1.00   sec  11.0 MBytes  90.0 Mbits/sec    3
+- - - - - - - - - - - - - - - - - - - - - - - - -
+[  4]   1.00-2.00   sec  5.00 MBytes  42.0 Mbits/sec    0    212 KBytes
+[  6]   1.00-2.00   sec  6.00 MBytes  48.0 Mbits/sec    0    212 KBytes
+[SUM]   1.00-2.00   sec  11.0 MBytes  90.0 Mbits/sec    0
+- - - - - - - - - - - - - - - - - - - - - - - - -
+[ ID] Interval           Transfer     Bandwidth       Retr
+[  4]   0.00-2.00   sec  10.0 MBytes  41.0 Mbits/sec    1             sender
+[  4]   0.00-2.00   sec  9.90 MBytes  40.5 Mbits/sec                  receiver
+[  6]   0.00-2.00   sec  12.0 MBytes  49.0 Mbits/sec    2             sender
+[  6]   0.00-2.00   sec  11.9 MBytes  48.5 Mbits/sec                  receiver
+'''
+
+
+class IperfTextParserTest(unittest.TestCase):
+
+    def test_parallel_streams_are_summed(self):
+        parser = IperfTextParser()
+        parser.feed(PARALLEL_OUTPUT)
+        intervals = parser.finish()
+        self.assertEqual(parser.streams, 2)
+        self.assertEqual(len(intervals), 2)
+        self.assertEqual(intervals[0]['bits_per_second'], 90e6)
+        self.assertEqual(intervals[0]['bytes'], 11 * 2**20)
+        self.assertEqual((intervals[0]['retransmits'], intervals[1]['retransmits']), (3, 0))
+        self.assertEqual(parser.summary('sender')['bits_per_second'], 90e6)
+        self.assertEqual(parser.summary('receiver')['bits_per_second'], 89e6)
+
+    def test_chunks_split_anywhere(self):
+        parser = IperfTextParser()
+        completed = [interval for position in range(0, len(PARALLEL_OUTPUT), 7)
+                     for interval in parser.feed(PARALLEL_OUTPUT[position:position + 7])]
+        self.assertEqual([interval['end'] for interval in completed], [1.0, 2.0])
+        self.assertEqual(parser.finish(), completed)
+
+    def test_single_stream_interval_completes_on_its_line(self):
+        parser = IperfTextParser()
+        completed = parser.feed("[  4]   0.00-1.00   sec  11.2 MBytes  94.0 Mbits/sec    0    212 KBytes\r\n")
+        self.assertEqual(len(completed), 1)
+        self.assertEqual(completed[0]['bits_per_second'], 94e6)
+        self.assertIsNone(parser.summary('sender'))
+
+
+class ConvergenceDetectorTest(unittest.TestCase):
+
+    def intervals(self, rates):
+        return [{'end': i + 1.0, 'bits_per_second': rate} for i, rate in enumerate(rates)]
+
+    def test_converged(self):
+        detector = ConvergenceDetector(window=3, tolerance=0.05, min_duration=3)
+        self.assertFalse(detector.converged(self.intervals([90e6, 100e6])))
+        self.assertFalse(detector.converged(self.intervals([50e6, 90e6, 100e6])))
+        self.assertTrue(detector.converged(self.intervals([50e6, 99e6, 100e6, 101e6])))
+        self.assertFalse(ConvergenceDetector(3, 0.05, 10).converged(self.intervals([100e6] * 4)))
+
+
+if __name__ == '__main__':
+    unittest.main()
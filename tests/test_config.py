@@ -0,0 +1,93 @@
+import os
+import tempfile
+import unittest
+from pyaml_env import parse_config
+from Libs.Functions import Vars
+
+
+TEMPLATE = os.path.join(os.path.dirname(os.path.dirname(os.path.abspath(__file__))), "Vars", "input.yaml.orig")
+
+# Vars/input.yaml of the first release
+OLD_INPUT_YAML = """
+iperf3_server:
+  ipv4: 10.152.10.48
+  port: 5201
+iperf3_client:
+  port: 5201
+  protocol: tcp
+fortigate:
+  username: user
+  password: secret
+netbox:
+  ipv4: 10.152.10.49
+  port: 443
+  use_ssl: True
+  token_ro: token
+  token_rw: tbd
+paths:
+  output_files: out_files
+  output_run: out_rundata
+repeat_counter: 4
+"""
+
+
+class VarsTest(unittest.TestCase):
+
+    def load(self, text):
+        cwd = os.getcwd()
+        os.chdir(tempfile.mkdtemp())
+        try:
+            os.makedirs("Vars")
+            with open("Vars/input.yaml", 'w') as file:
+                file.write(text)
+            return Vars().inputVars
+        finally:
+            os.chdir(cwd)
+
+    def test_old_input_yaml_gets_defaults(self):
+        inputVars = self.load(OLD_INPUT_YAML)
+        self.assertEqual(inputVars.iperf3_server.port_pool, [5201])
+        self.assertEqual(inputVars.scheduler.concurrency, 4)
+        self.assertEqual(inputVars.scheduler.timeout, 240)
+        self.assertEqual(inputVars.inventory.ttl, 3600)
+        self.assertEqual(inputVars.netbox.pool_size, 8)
+        self.assertEqual(inputVars.iperf3_server.ready_timeout, 10)
+        self.assertEqual(inputVars.fortigate.read_timeout, 60)
+        self.assertEqual(inputVars.paths.history_db, "out_rundata/history.sqlite")
+        self.assertFalse(inputVars.adaptive.enabled)
+        self.assertFalse(inputVars.iperf3_client.reverse)
+        self.assertEqual(inputVars.iperf3_client.profiles, [])
+        self.assertEqual(inputVars.preflight.port, 22)
+        self.assertEqual(inputVars.fortigate.port, 22)
+        self.assertEqual(inputVars.tracing.trace_file, "out_rundata/trace.json")
+        self.assertEqual(inputVars.scheduler.uplink_mbps, 0)
+        self.assertEqual(inputVars.incremental.time_budget, 14400)
+        self.assertEqual(inputVars.service.listen, "127.0.0.1:8201")
+        self.assertEqual(inputVars.inventory.regions, [1])
+        self.assertEqual(inputVars.sharding.nodes, [])
+        self.assertEqual(inputVars.retry.connect_attempts, 3)
+
+    def test_every_setting_of_the_template_has_a_default(self):
+        def keys(config, prefix=""):
+            for key, value in config.items():
+                yield prefix + key
+                if isinstance(value, dict):
+                    yield from keys(value, prefix + key + ".")
+        inputVars = self.load(OLD_INPUT_YAML)
+        for key in keys(parse_config(TEMPLATE)):
+            section = inputVars
+            for name in key.split("."):
+                self.assertIn(name, section.__dict__, key)
+                section = getattr(section, name)
+
+    def test_settings_win_over_defaults(self):
+        inputVars = self.load(OLD_INPUT_YAML.replace("  port: 5201\niperf3_client",
+                                                     "  port: 5201\n  port_pool: [6001, 6002]\niperf3_client")
+                              + "scheduler:\n  concurrency: 2\n")
+        self.assertEqual(inputVars.iperf3_server.port_pool, [6001, 6002])
+        self.assertEqual(inputVars.scheduler.concurrency, 2)
+        self.assertEqual(inputVars.scheduler.timeout, 240)
+
+
+if __name__ == '__main__':
+    unittest.main()
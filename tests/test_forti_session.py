@@ -0,0 +1,124 @@
+import json
+import re
+import unittest
+from collections import deque
+from types import SimpleNamespace
+from unittest import mock
+from Libs.FortiSession import FortiSession
+from Libs.FortiSession import JsonStreamScanner
+
+PROMPT = "FGT60F # "
+
+
+class ScriptedChannel:
+
+    RETURN = "\n"
+
+    def __init__(self, replies):
+        ''' Stand-in for the netmiko connection, every written command
+        queues its scripted chunks, one chunk per read_channel() call.
+        '''
+        self.replies = replies
+        self.chunks = deque()
+
+    def write_channel(self, data):
+        for command in data.split(self.RETURN):
+            if command:
+                self.chunks.extend(self.replies[command])
+
+    def read_channel(self):
+        return self.chunks.popleft() if self.chunks else ""
+
+
+def make_session(replies, read_timeout=1):
+    inputVars = SimpleNamespace(fortigate=SimpleNamespace(
+        read_timeout=read_timeout, port=22, username="user", password="password", connect_timeout=1))
+    session = FortiSession(inputVars, "192.0.2.1")
+    session.session = ScriptedChannel(replies)
+    session.prompt_pattern = re.compile(re.escape("FGT60F") + r"\s*(\([^)]*\)\s*)?[#$]")
+    return session
+
+
+class JsonStreamScannerTest(unittest.TestCase):
+
+    def test_document_split_across_chunks(self):
+        scanner = JsonStreamScanner()
+        chunks = ['echo\r\n{"a": {"b": "}{"}', ', "c": [1, 2]', '}\r\n', PROMPT]
+        completed = [scanner.feed(chunk) for chunk in chunks]
+        self.assertEqual(completed, [False, False, True, True])
+        self.assertEqual(json.loads(scanner.document()), {'a': {'b': "}{"}, 'c': [1, 2]})
+
+    def test_escaped_quote_in_string(self):
+        scanner = JsonStreamScanner()
+        self.assertTrue(scanner.feed('{"error": "say \\"}\\" twice"}'))
+        self.assertEqual(json.loads(scanner.document()), {'error': 'say "}" twice'})
+
+    def test_incomplete_and_missing_document(self):
+        scanner = JsonStreamScanner()
+        self.assertFalse(scanner.feed('text {"a": 1'))
+        self.assertEqual(scanner.document(), '{"a": 1')
+        self.assertEqual(JsonStreamScanner().document(), "")
+
+
+class RunTestTest(unittest.TestCase):
+
+    def test_reverse_pass_after_late_prompt(self):
+        ''' The prompt after the forward JSON arrives in a later read,
+        the reverse pass must still get its own document.
+        '''
+        forward = "diagnose traffictest run -c 192.0.2.2 -B 192.0.2.1 -J"
+        reverse = "diagnose traffictest run -c 192.0.2.2 -B 192.0.2.1 -R -J"
+        session = make_session({
+            forward: [forward + "\r\n", '{"end": {"pass": "forward"}}\r\n', PROMPT],
+            reverse: [reverse + "\r\n", '{"end": {"pass": "reverse"}}\r\n', PROMPT],
+        })
+        self.assertEqual(json.loads(session.run_test(forward))['end']['pass'], "forward")
+        self.assertEqual(json.loads(session.run_test(reverse, 'test_reverse'))['end']['pass'], "reverse")
+        self.assertEqual(set(session.timings), {'test', 'test_reverse'})
+
+    def test_error_without_json_ends_on_prompt(self):
+        command = "diagnose traffictest run -c 192.0.2.2 -B 192.0.2.1 -J"
+        session = make_session({command: [command + "\r\n", "iperf3: error\r\n" + PROMPT]})
+        self.assertEqual(session.run_test(command), "")
+
+
+class AbortTest(unittest.TestCase):
+
+    def test_abort_before_connect(self):
+        session = make_session({})
+        session.abort()
+        with mock.patch('netmiko.ConnectHandler') as connect_handler:
+            with self.assertRaises(TimeoutError):
+                session.connect()
+        connect_handler.assert_not_called()
+
+    def test_abort_during_connect(self):
+        session = make_session({})
+        with mock.patch('netmiko.ConnectHandler', side_effect=lambda **device: session.abort()):
+            with self.assertRaises(TimeoutError):
+                session.connect()
+
+
+class RunAdaptiveTestTest(unittest.TestCase):
+
+    command = "diagnose traffictest run -c 192.0.2.2 -B 192.0.2.1 -t 30"
+    adaptive = SimpleNamespace(window=3, tolerance=0.05, min_duration=5, max_duration=0)
+    interval = "[  4]   0.00-1.00   sec  11.2 MBytes  94.0 Mbits/sec    0    212 KBytes\r\n"
+
+    def test_timeout_is_partial(self):
+        session = make_session({self.command: [self.command + "\r\n", self.interval],
+                                "\x03": []}, read_timeout=0.1)
+        document = session.run_adaptive_test(self.command, self.adaptive)
+        self.assertEqual(document['adaptive']['stop_reason'], "timeout")
+        self.assertTrue(document['adaptive']['partial'])
+
+    def test_abort_raises(self):
+        session = make_session({self.command: [self.command + "\r\n", self.interval],
+                                "\x03": []})
+        session.abort()
+        with self.assertRaises(TimeoutError):
+            session.run_adaptive_test(self.command, self.adaptive)
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,60 @@
+import json
+import os
+import tempfile
+import unittest
+from unittest import mock
+import main
+
+IP = "192.0.2.1"
+FORWARD = {
+    'intervals': [{'sum': {'end': 1.0, 'bits_per_second': 90e6, 'retransmits': 0}}],
+    'end': {'sum_sent': {'bits_per_second': 90e6, 'retransmits': 0},
+            'sum_received': {'bits_per_second': 89e6}},
+}
+REVERSE = dict(FORWARD, end={'sum_sent': {'bits_per_second': 50e6},
+                             'sum_received': {'bits_per_second': 48e6}})
+
+
+class FakeInventory:
+
+    def get_device_by_ip(self, ip):
+        return {'name': "FW-1", 'site': {'id': 1}}
+
+
+@mock.patch('main.get_circuit_speed_from_netbox', return_value=100000000)
+class ParseDeviceOutputTest(unittest.TestCase):
+
+    def setUp(self):
+        self.path = tempfile.mkdtemp()
+
+    def write(self, suffix, text):
+        with open(os.path.join(self.path, IP+suffix), 'w') as file:
+            file.write(text)
+
+    def parse(self):
+        return main.parse_device_output(IP+"/24", self.path, FakeInventory())
+
+    def test_reverse_pass_is_download(self, speed):
+        self.write("", json.dumps(FORWARD))
+        self.write(".reverse", json.dumps(REVERSE))
+        host, result, valid, series = self.parse()
+        self.assertEqual((host, valid), ("FW-1", True))
+        self.assertEqual((result['upload'], result['download']), (90000000, 48000000))
+        self.assertNotIn('reverse_error', result)
+
+    def test_failed_reverse_pass_keeps_upload(self, speed):
+        self.write("", json.dumps(FORWARD))
+        self.write(".reverse", "iperf3: error - unable to connect to server\r\n")
+        host, result, valid, series = self.parse()
+        self.assertTrue(valid)
+        self.assertEqual((result['upload'], result['download']), (90000000, None))
+        self.assertIn("JSONDecodeError", result['reverse_error'])
+
+    def test_missing_output(self, speed):
+        host, result, valid, series = self.parse()
+        self.assertFalse(valid)
+        self.assertEqual((result['upload'], result['download']), ("0", "0"))
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,34 @@
+import os
+import tempfile
+import unittest
+from Libs.Results import ResultStore
+
+
+class ResultStoreTest(unittest.TestCase):
+
+    def setUp(self):
+        self.jsonl_file = os.path.join(tempfile.mkdtemp(), "output.json.jsonl")
+
+    def test_resume_keeps_the_last_record(self):
+        store = ResultStore(self.jsonl_file)
+        store.append("10.0.0.1/24", "FW-1", {'error': "timeout"}, False)
+        store.append("10.0.0.2/24", "FW-2", {'bps': 1}, True)
+        store.append("10.0.0.1/24", "FW-1", {'bps': 2}, True)
+        resumed = ResultStore(self.jsonl_file, resume=True)
+        self.assertEqual(resumed.to_final_dict(), {'FW-1': {'bps': 2}, 'FW-2': {'bps': 1}})
+        self.assertEqual(resumed.pending(["10.0.0.1/24", "10.0.0.3/24"]), ["10.0.0.3/24"])
+        self.assertFalse(os.path.exists(ResultStore(self.jsonl_file).jsonl_file))
+
+    def test_compact(self):
+        store = ResultStore(self.jsonl_file)
+        for run in range(3):
+            store.append("10.0.0.1/24", "FW-1", {'run': run}, True)
+            store.append("10.0.0.2/24", "FW-2", {'run': run}, True)
+        store.compact(["10.0.0.1/24"])
+        with open(self.jsonl_file) as file:
+            self.assertEqual(len(file.readlines()), 1)
+        self.assertEqual(ResultStore(self.jsonl_file, resume=True).to_final_dict(), {'FW-1': {'run': 2}})
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,133 @@
+import asyncio
+import threading
+import time
+import unittest
+from unittest import mock
+from Libs.Retry import CircuitBreaker
+from Libs.Retry import CircuitOpenError
+from Libs.Retry import RetryPolicy
+from Libs.Retry import backoff_delay
+
+
+class Flaky:
+
+    def __init__(self, *outcomes):
+        ''' Callable raising or returning the outcomes one per call.
+        '''
+        self.outcomes = list(outcomes)
+        self.calls = 0
+
+    def __call__(self):
+        self.calls += 1
+        outcome = self.outcomes.pop(0)
+        if isinstance(outcome, Exception):
+            raise outcome
+        return outcome
+
+
+def is_transient(error):
+    return isinstance(error, ConnectionError)
+
+
+@mock.patch('Libs.Retry.time.sleep')
+class RetryPolicyTest(unittest.TestCase):
+
+    def test_transient_errors_are_retried(self, sleep):
+        function = Flaky(ConnectionError(), ConnectionError(), "ok")
+        policy = RetryPolicy(3, transient=is_transient)
+        self.assertEqual(policy.call(function), "ok")
+        self.assertEqual((function.calls, policy.retries, sleep.call_count), (3, 2, 2))
+
+    def test_last_transient_error_is_raised(self, sleep):
+        policy = RetryPolicy(2, transient=is_transient)
+        with self.assertRaises(ConnectionError):
+            policy.call(Flaky(ConnectionError(), ConnectionError()))
+        self.assertEqual(policy.retries, 1)
+
+    def test_permanent_error_is_not_retried(self, sleep):
+        function = Flaky(KeyError("id"), "ok")
+        with self.assertRaises(KeyError):
+            RetryPolicy(3, transient=is_transient).call(function)
+        self.assertEqual(function.calls, 1)
+        sleep.assert_not_called()
+
+    def test_open_circuit_fails_fast(self, sleep):
+        breaker = CircuitBreaker(threshold=2, reset_timeout=60)
+        policy = RetryPolicy(5, transient=is_transient, breaker=breaker)
+        function = Flaky(ConnectionError(), ConnectionError(), "ok")
+        with self.assertRaises(CircuitOpenError):
+            policy.call(function)
+        self.assertEqual((function.calls, breaker.state()), (2, 'open'))
+
+    def test_stop_ends_the_wait(self, sleep):
+        stop = threading.Event()
+        threading.Timer(0.1, stop.set).start()
+        function = Flaky(ConnectionError(), "ok")
+        time_start = time.time()
+        with self.assertRaises(ConnectionError):
+            RetryPolicy(2, base_delay=60, max_delay=60, transient=is_transient, stop=stop).call(function)
+        self.assertLess(time.time() - time_start, 5)
+        self.assertEqual(function.calls, 1)
+        sleep.assert_not_called()
+
+    def test_async_call(self, sleep):
+        async def coroutine(function):
+            return function()
+
+        function = Flaky(ConnectionError(), "ok")
+        policy = RetryPolicy(2, base_delay=0, transient=is_transient)
+        self.assertEqual(asyncio.run(policy.call_async(coroutine, function)), "ok")
+        self.assertEqual(policy.retries, 1)
+
+
+class CircuitBreakerTest(unittest.TestCase):
+
+    def open_breaker(self, clock):
+        breaker = CircuitBreaker(threshold=2, reset_timeout=60)
+        with mock.patch('Libs.Retry.time.time', return_value=clock):
+            breaker.failure()
+            breaker.failure()
+        return breaker
+
+    def test_half_open_trial(self):
+        breaker = self.open_breaker(1000)
+        with mock.patch('Libs.Retry.time.time', return_value=1030):
+            self.assertFalse(breaker.allow())
+        with mock.patch('Libs.Retry.time.time', return_value=1061):
+            self.assertEqual(breaker.state(), 'half_open')
+            self.assertTrue(breaker.allow())
+            # one trial at a time
+            self.assertFalse(breaker.allow())
+            breaker.success()
+            self.assertEqual(breaker.state(), 'closed')
+            self.assertTrue(breaker.allow())
+
+    def test_failed_trial_opens_again(self):
+        breaker = self.open_breaker(1000)
+        with mock.patch('Libs.Retry.time.time', return_value=1061):
+            self.assertTrue(breaker.allow())
+            breaker.failure()
+            self.assertEqual(breaker.state(), 'open')
+
+    @mock.patch('Libs.Retry.time.sleep')
+    def test_permanent_error_in_trial_closes_circuit(self, sleep):
+        breaker = self.open_breaker(1000)
+        policy = RetryPolicy(3, transient=is_transient, breaker=breaker)
+        with mock.patch('Libs.Retry.time.time', return_value=1061):
+            with self.assertRaises(KeyError):
+                policy.call(Flaky(KeyError("results")))
+            self.assertEqual(breaker.state(), 'closed')
+            self.assertEqual(policy.call(Flaky("ok")), "ok")
+
+
+class BackoffTest(unittest.TestCase):
+
+    def test_delay_is_capped_and_jittered(self):
+        delays = [backoff_delay(attempt, 1, 30) for attempt in range(1, 10) for _ in range(20)]
+        self.assertTrue(all(0 <= delay <= 30 for delay in delays))
+        self.assertTrue(all(backoff_delay(1, 1, 30) <= 1 for _ in range(20)))
+        self.assertGreater(len(set(delays)), 1)
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,94 @@
+import json
+import os
+import tempfile
+import unittest
+from types import SimpleNamespace
+from unittest import mock
+from Libs.History import HistoryStore
+from Libs.Tracing import Tracer
+import main
+
+CLIENT = "192.0.2.1/24"
+
+
+class FakeInventory:
+
+    def get_device_by_ip(self, ip):
+        return {'name': "FW-1", 'site': {'id': 1}, 'device_type': {'slug': "fortigate-60f"}}
+
+    def get_site(self, site_id):
+        return {'id': site_id, 'name': "SITE-1"}
+
+
+class FakeServerManager:
+
+    def ensure_running(self):
+        pass
+
+    def get_results(self):
+        return []
+
+    def restart(self, port):
+        return True
+
+
+def make_input_vars():
+    return SimpleNamespace(
+        retry=SimpleNamespace(deferred_rounds=1, base_delay=0, max_delay=0),
+        preflight=SimpleNamespace(enabled=False),
+        scheduler=SimpleNamespace(uplink_mbps=0, concurrency=1, timeout=60),
+        incremental=SimpleNamespace(time_budget=0),
+        tracing=SimpleNamespace(trace_file="", prometheus_file=""))
+
+
+class DeferredRetryTest(unittest.TestCase):
+
+    def setUp(self):
+        self.path = tempfile.mkdtemp()
+        self.history = HistoryStore(os.path.join(self.path, "history.sqlite"))
+        self.addCleanup(self.history.close)
+
+    def run_fleet(self, attempts):
+        ''' Run one client whose test attempts end with the given
+        (error, result, valid) one after another.
+        '''
+        attempts = list(attempts)
+        outcomes = []
+
+        def run_iperf3_client(inputVars, ip, commands, path, time_start, session_pool=None):
+            error, result, valid = attempts.pop(0)
+            outcomes.append(("FW-1", result, valid, None))
+            with open(os.path.join(path, ip+".trace"), "w") as file:
+                json.dump({'spans': [], 'counters': {}, 'error': error}, file)
+
+        session_pool = SimpleNamespace(abort=lambda ip: None)
+        with mock.patch('main.run_iperf3_client', run_iperf3_client), \
+                mock.patch('main.get_forti_commands', return_value=[]), \
+                mock.patch('main.parse_device_output', side_effect=lambda *args: outcomes.pop(0)):
+            return main.run_fleet(make_input_vars(), "run-1", [CLIENT],
+                                  os.path.join(self.path, "output.json"), FakeInventory(),
+                                  self.history, FakeServerManager(), [5201], Tracer("run-1"),
+                                  self.path, session_pool=session_pool)
+
+    def history_rows(self):
+        return self.history.connection.execute("SELECT valid, download FROM tests").fetchall()
+
+    def test_valid_retry_leaves_one_history_row(self):
+        timeout = {'type': "TimeoutError", 'message': "no prompt", 'transient': True}
+        final_output, devices = self.run_fleet([
+            (timeout, {'download': 0}, False),
+            (None, {'download': 90000000}, True),
+        ])
+        self.assertEqual(devices['retried'], 1)
+        self.assertEqual(final_output['FW-1']['attempts'], 2)
+        self.assertEqual([tuple(row) for row in self.history_rows()], [(1, 90000000)])
+
+    def test_permanent_error_is_recorded_once(self):
+        denied = {'type': "NetmikoAuthenticationException", 'message': "denied", 'transient': False}
+        _, devices = self.run_fleet([(denied, {'download': 0}, False)])
+        self.assertEqual(devices['retried'], 0)
+        self.assertEqual([tuple(row) for row in self.history_rows()], [(0, 0)])
+
+
+if __name__ == '__main__':
+    unittest.main()
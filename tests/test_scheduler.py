@@ -0,0 +1,186 @@
+import time
+import unittest
+from Libs.Scheduler import BandwidthBudget
+from Libs.Scheduler import PortPool
+from Libs.Scheduler import TestScheduler
+
+
+class FakeProcess:
+
+    def __init__(self, polls, stops=True, killable=True):
+        ''' Process alive for `polls` is_alive() calls,
+        which stops on terminate() if `stops` and on kill() if `killable`.
+        '''
+        self.polls = polls
+        self.stops = stops
+        self.killable = killable
+        self.terminated = False
+        self.killed = False
+
+    def running(self):
+        return self.polls >= 0 and not (self.terminated and self.stops) and not self.killed
+
+    def is_alive(self):
+        self.polls -= 1
+        return self.running()
+
+    def terminate(self):
+        self.terminated = True
+
+    def kill(self):
+        self.killed = self.killable
+
+    def join(self, timeout=None):
+        if self.running():
+            time.sleep(timeout or 0)
+
+
+class PortPoolTest(unittest.TestCase):
+
+    def test_lease_and_release(self):
+        pool = PortPool([5201, 5202])
+        self.assertEqual((pool.lease('a'), pool.lease('b'), pool.lease('c')), (5201, 5202, None))
+        pool.release(5201)
+        pool.release(5201)
+        self.assertEqual((pool.lease('c'), len(pool)), (5201, 2))
+
+    def test_remove(self):
+        pool = PortPool([5201, 5202])
+        pool.lease('a')
+        pool.remove(5201)
+        pool.remove(5202)
+        pool.release(5201)
+        self.assertEqual((len(pool), pool.lease('b')), (0, None))
+
+
+class BandwidthBudgetTest(unittest.TestCase):
+
+    def test_fits(self):
+        budget = BandwidthBudget(1000)
+        # a demand larger than the capacity is admitted alone
+        self.assertTrue(budget.fits(5000))
+        budget.reserve('a', 600)
+        self.assertTrue(budget.fits(400))
+        self.assertFalse(budget.fits(401))
+        budget.release('a')
+        self.assertEqual(budget.used(), 0)
+
+
+class TestSchedulerTest(unittest.TestCase):
+
+    def run_budget(self, demands, **kwargs):
+        ''' Run jobs of the given demands in a 1000 bps budget.
+            Output: list of (job, jobs in flight when it was started)
+        '''
+        scheduler = TestScheduler(PortPool(range(5201, 5205)), 4, poll_interval=0,
+                                  budget=BandwidthBudget(1000))
+        started = []
+
+        def launch(job, port):
+            started.append((job, sorted(scheduler.in_flight)))
+            return [FakeProcess(2)]
+
+        scheduler.run(demands, launch, demand=demands.get, **kwargs)
+        return started
+
+    def test_concurrency_is_capped_by_ports(self):
+        scheduler = TestScheduler(PortPool([5201, 5202]), concurrency=8, poll_interval=0)
+        in_flight = []
+
+        def launch(job, port):
+            in_flight.append(sorted(port for port, _, _ in scheduler.in_flight.values()) + [port])
+            return [FakeProcess(2)]
+
+        self.assertEqual(scheduler.run(['a', 'b', 'c', 'd', 'e'], launch), [])
+        self.assertEqual(scheduler.concurrency, 2)
+        self.assertEqual(len(in_flight), 5)
+        self.assertTrue(all(len(ports) <= 2 and len(set(ports)) == len(ports) for ports in in_flight))
+
+    def test_budget_packs_small_jobs_next_to_large_ones(self):
+        started = self.run_budget({'large': 700, 'medium': 500, 'small': 300})
+        self.assertEqual(started, [('large', []), ('small', ['large']), ('medium', [])])
+
+    def test_ordered_jobs_keep_their_order(self):
+        started = self.run_budget({'small': 300, 'large': 700, 'medium': 500}, ordered=True)
+        self.assertEqual(started, [('small', []), ('large', ['small']), ('medium', [])])
+
+    def test_deadline(self):
+        scheduler = TestScheduler(PortPool([5201]), 1, poll_interval=0)
+        self.assertFalse(scheduler.past_deadline(None))
+        scheduler.durations = [10]
+        self.assertTrue(scheduler.past_deadline(time.time() + 5))
+        self.assertFalse(scheduler.past_deadline(time.time() + 20))
+        launched = []
+        scheduler.run(['a', 'b'], lambda job, port: launched.append(job) or [FakeProcess(0)],
+                      deadline=time.time() + 5)
+        self.assertEqual((launched, scheduler.not_started), ([], ['a', 'b']))
+
+    def test_simulate_staggers_jobs_on_the_ports(self):
+        scheduler = TestScheduler(PortPool([5201, 5202]), concurrency=8)
+        assignments, clock, not_started = scheduler.simulate(['a', 'b', 'c', 'd', 'e'], 10)
+        self.assertEqual([assignments[job]['start'] for job in 'abcde'], [0, 0, 10, 10, 20])
+        self.assertEqual([assignments[job]['port'] for job in 'abc'], [5201, 5202, 5201])
+        self.assertEqual((clock, not_started), (30, []))
+
+    def test_simulate_with_budget(self):
+        demands = {'large': 700, 'medium': 500, 'small': 300}
+        scheduler = TestScheduler(PortPool(range(5201, 5205)), 4, budget=BandwidthBudget(1000))
+        assignments, clock, _ = scheduler.simulate(demands, 10, demand=demands.get)
+        self.assertEqual({job: value['start'] for job, value in assignments.items()},
+                         {'large': 0, 'small': 0, 'medium': 10})
+        self.assertEqual(clock, 20)
+
+    def test_simulate_time_budget_leaves_jobs_not_started(self):
+        scheduler = TestScheduler(PortPool([5201]), 1)
+        assignments, clock, not_started = scheduler.simulate(['a', 'b', 'c'], 10, time_budget=25)
+        self.assertEqual((list(assignments), clock, not_started), (['a', 'b'], 20, ['c']))
+
+    def test_run_releases_ports_and_times_out(self):
+        pool = PortPool([5201, 5202])
+        scheduler = TestScheduler(pool, 2, timeout=0, poll_interval=0)
+        processes = {'done': FakeProcess(0), 'hung': FakeProcess(1000)}
+        timed_out = scheduler.run(['done', 'hung'], lambda job, port: [processes[job]])
+        self.assertEqual(timed_out, ['hung'])
+        self.assertTrue(processes['hung'].terminated)
+        self.assertFalse(processes['hung'].killed)
+        self.assertEqual((len(pool.free), scheduler.in_flight), (2, {}))
+
+    def test_hung_jobs_are_stopped_together(self):
+        pool = PortPool([5201, 5202, 5203])
+        scheduler = TestScheduler(pool, 3, timeout=0, poll_interval=0.01, grace=0.3)
+        processes = [FakeProcess(10**6, stops=False) for _ in range(3)]
+        time_start = time.time()
+        timed_out = scheduler.run(['a', 'b', 'c'], lambda job, port: [processes.pop()])
+        self.assertEqual(sorted(timed_out), ['a', 'b', 'c'])
+        self.assertLess(time.time() - time_start, 0.6)
+        self.assertEqual(len(pool.free), 3)
+
+    def test_jobs_without_a_port_left_are_not_started(self):
+        pool = PortPool([5201])
+        scheduler = TestScheduler(pool, 1, timeout=0, poll_interval=0)
+        timed_out = scheduler.run(['a', 'b', 'c'], lambda job, port: [FakeProcess(1000)],
+                                  on_timeout=lambda job, port: pool.remove(port))
+        self.assertEqual((timed_out, scheduler.not_started), (['a'], ['b', 'c']))
+
+    def test_port_of_a_running_thread_is_not_reused(self):
+        scheduler = TestScheduler(PortPool([5201]), 1, timeout=0, poll_interval=0, grace=0)
+        # a TestThread cannot be killed, it ends on its own
+        thread = FakeProcess(5, stops=False, killable=False)
+        launched = []
+
+        def launch(job, port):
+            launched.append((job, port, thread.running()))
+            return [thread if job == 'stuck' else FakeProcess(0)]
+
+        scheduler.run(['stuck', 'next'], launch)
+        self.assertEqual(launched, [('stuck', 5201, True), ('next', 5201, False)])
+
+    def test_process_ignoring_terminate_is_killed(self):
+        scheduler = TestScheduler(PortPool([5201]), 1, timeout=0, poll_interval=0, grace=0)
+        process = FakeProcess(1000, stops=False)
+        self.assertEqual(scheduler.run(['stuck'], lambda job, port: [process]), ['stuck'])
+        self.assertTrue(process.terminated and process.killed)
+
+
+if __name__ == '__main__':
+    unittest.main()